@@ -10,10 +10,10 @@ import torchvision
 import torchvision.transforms as transforms
 import wandb
 from pytorch_lightning.logging import CometLogger, TensorBoardLogger, WandbLogger
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, BatchSampler, SequentialSampler
 from torchvision.datasets import MNIST, FashionMNIST, CIFAR10, ImageNet, LSUN
 
-from gans.datasets import CelebAHQ
+from gans.datasets import CelebAHQ, PackedCelebAHQ, PackedImageFolder, InMemoryImageDataset, InMemoryDataLoader, ToUint8Tensor
 from gans.optim import OAdam
 from ..helpers import inception_score
 
@@ -72,12 +72,29 @@ class GAN(pl.LightningModule):
             else:
                 raise ValueError()
 
+        if self.hparams.gradient_penalty_interval < 1:
+            raise ValueError("Gradient penalty interval has to be at least 1: " + str(self.hparams.gradient_penalty_interval))
+
+        if not 0 < self.hparams.gradient_penalty_batch_fraction <= 1:
+            raise ValueError("Gradient penalty batch fraction has to be in (0, 1]: " + str(self.hparams.gradient_penalty_batch_fraction))
+
+        if self.hparams.minibatch_std_dev_group_size is not None and self.hparams.minibatch_std_dev_group_size < 1:
+            raise ValueError("Minibatch standard deviation group size has to be at least 1: " + str(self.hparams.minibatch_std_dev_group_size))
+
+        if self.hparams.discriminator_steps > 1 and self.hparams.accumulate_grad_batches > 1:
+            # The additional discriminator updates step the optimizer on every batch, outside of the accumulation
+            raise ValueError("Multiple discriminator steps can not be combined with gradient accumulation")
+
         self.generator = generator
         self.discriminator = discriminator
         # self.scorer = scorer
 
         self.real_images = None
+        self.scaled_real_images = None
         self.y = None
+        self.batch_key = None
+        self.discriminator_step_count = 0
+        self.amortized_gradient_penalty = 0
         self.experience = None
 
         self.train_dataset = None
@@ -105,9 +122,12 @@ class GAN(pl.LightningModule):
         elif isinstance(self.logger, WandbLogger):
             pass
 
-    def forward(self, x, y):
-        output = self.generator(x, y)
-        return output
+    def forward(self, x, y, output_sizes=None, max_size=None):
+        return self.generator(x, y, output_sizes=output_sizes, max_size=max_size)
+
+    def output_sizes(self):
+        # Without multi-scale gradients the discriminator only sees the full resolution
+        return None if self.hparams.multi_scale_gradient else [self.hparams.image_size]
 
     def discriminator_loss(self, real_validity, fake_validity):
         if self.hparams.loss_strategy == "wgan":
@@ -172,6 +192,10 @@ class GAN(pl.LightningModule):
 
         return loss.unsqueeze(0)
 
+    def relativistic_loss(self):
+        # Only relativistic generator losses read the validity of the real images
+        return self.hparams.loss_strategy in ["r-hinge", "ra-hinge", "ra-lsgan", "ra-sgan"]
+
     def generator_loss(self, real_validity, fake_validity):
         if self.hparams.loss_strategy == "wgan":
             fake_loss = -fake_validity
@@ -233,59 +257,99 @@ class GAN(pl.LightningModule):
         for weight in self.discriminator.parameters():
             weight.data.clamp_(-self.hparams.weight_clipping, self.hparams.weight_clipping)
 
-    # TODO: Need to check if gradient penalty works well with multi-scale gradient
-    def gradient_penalty(self, real_images, fake_images, y):
-        if self.hparams.gradient_penalty_coefficient != 0:
-            alpha = torch.rand(real_images.size(0), 1, 1, 1, device=real_images.device)
+    def interpolate(self, real_images, fake_images):
+        # Lists are pyramids, every level is interpolated with the same alpha
+        multi_scale = isinstance(real_images, list)
+        if not multi_scale:
+            real_images, fake_images = [real_images], [fake_images]
+
+        # The penalty can be estimated on a fraction of the batch
+        batch_size = real_images[-1].size(0)
+        size = max(1, math.ceil(self.hparams.gradient_penalty_batch_fraction * batch_size))
+
+        if self.hparams.minibatch_std_dev_group_size is not None:
+            # The subset has to consist of whole minibatch standard deviation groups
+            group_size = self.hparams.minibatch_std_dev_group_size
+            size = min(batch_size, math.ceil(size / group_size) * group_size)
+        alpha = torch.rand(size, 1, 1, 1, device=real_images[-1].device)
+
+        interpolates = []
+        for real_level, fake_level in zip(real_images, fake_images):
+            real_level, fake_level = real_level[:size], fake_level[:size]
 
             if self.hparams.gradient_penalty_strategy == "div":
                 # noinspection PyTypeChecker
-                interpolates = alpha * fake_images + (1 - alpha) * real_images
+                interpolates_level = alpha * fake_level + (1 - alpha) * real_level
             else:
                 # noinspection PyTypeChecker
-                interpolates = alpha * real_images + (1 - alpha) * fake_images
+                interpolates_level = alpha * real_level + (1 - alpha) * fake_level
 
-            interpolates.requires_grad_()
+            interpolates.append(interpolates_level.requires_grad_())
 
-            if self.hparams.multi_scale_gradient:
-                scaled_interpolates = self.to_scaled_images(interpolates)
-                interpolates_validity = self.discriminator(scaled_interpolates, y)
-            else:
-                interpolates_validity = self.discriminator(interpolates, y)
+        return interpolates if multi_scale else interpolates[0]
 
-            gradients = torch.autograd.grad(
-                outputs=interpolates_validity,
-                inputs=interpolates,
-                grad_outputs=torch.ones_like(interpolates_validity, device=real_images.device),
-                create_graph=True
-            )[0]
+    def penalty(self, interpolates, interpolates_validity):
+        # A single backward pass yields the gradients of all pyramid levels
+        gradients = torch.autograd.grad(
+            outputs=interpolates_validity,
+            inputs=interpolates,
+            grad_outputs=torch.ones_like(interpolates_validity, device=interpolates_validity.device),
+            create_graph=True
+        )
 
-            gradients = gradients.view(gradients.size(0), -1)
+        # [B x N] The gradients of all levels form one vector per sample
+        gradients = torch.cat([gradient.view(gradient.size(0), -1) for gradient in gradients], dim=1)
 
-            if self.hparams.gradient_penalty_strategy == "0-gp":
-                # TODO https://openreview.net/forum?id=ByxPYjC5KQ
-                penalties = gradients.norm(dim=1) ** self.hparams.gradient_penalty_power
-            elif self.hparams.gradient_penalty_strategy == "1-gp":
-                penalties = (gradients.norm(dim=1) - 1) ** self.hparams.gradient_penalty_power
-            elif self.hparams.gradient_penalty_strategy == "lp":
-                # noinspection PyTypeChecker
-                penalties = torch.max(torch.tensor(0.0, device=real_images.device), gradients.norm(dim=1) - 1) ** self.hparams.gradient_penalty_power
-            elif self.hparams.gradient_penalty_strategy == "div":
-                penalties = gradients.norm(dim=1) ** self.hparams.gradient_penalty_power
-            elif self.hparams.gradient_penalty_strategy == "ct":
-                penalties = (gradients.norm(dim=1) - 1) ** self.hparams.gradient_penalty_power
-            else:
-                raise ValueError()
+        if self.hparams.gradient_penalty_strategy == "0-gp":
+            # TODO https://openreview.net/forum?id=ByxPYjC5KQ
+            penalties = gradients.norm(dim=1) ** self.hparams.gradient_penalty_power
+        elif self.hparams.gradient_penalty_strategy == "1-gp":
+            penalties = (gradients.norm(dim=1) - 1) ** self.hparams.gradient_penalty_power
+        elif self.hparams.gradient_penalty_strategy == "lp":
+            # noinspection PyTypeChecker
+            penalties = torch.max(torch.tensor(0.0, device=gradients.device), gradients.norm(dim=1) - 1) ** self.hparams.gradient_penalty_power
+        elif self.hparams.gradient_penalty_strategy == "div":
+            penalties = gradients.norm(dim=1) ** self.hparams.gradient_penalty_power
+        elif self.hparams.gradient_penalty_strategy == "ct":
+            penalties = (gradients.norm(dim=1) - 1) ** self.hparams.gradient_penalty_power
+        else:
+            raise ValueError()
 
-            return self.hparams.gradient_penalty_coefficient * penalties.mean().unsqueeze(0)
+        return self.hparams.gradient_penalty_coefficient * penalties.mean().unsqueeze(0)
+
+    def regularization_step(self):
+        # Lazy regularization: the gradient penalty is only computed every {self.gradient_penalty_interval} discriminator steps
+        return self.hparams.gradient_penalty_coefficient != 0 and self.discriminator_step_count % self.hparams.gradient_penalty_interval == 0
+
+    def fused_discriminator(self, inputs, y):
+        """
+        Runs the discriminator once over several equally sized batches concatenated along the batch dimension.
+        The minibatch standard deviation is still computed for every batch on its own
+        :param inputs: list of batches, each one a list of scaled images if multi-scale gradient is enabled
+        :param y: labels of a single batch
+        :return: validity of each batch
+        """
+        if self.hparams.multi_scale_gradient:
+            x = [torch.cat(scaled_inputs) for scaled_inputs in zip(*inputs)]
         else:
-            return 0
+            x = torch.cat(inputs)
+
+        validity = self.discriminator(x, torch.cat([y] * len(inputs)), chunks=len(inputs))
+
+        return validity.chunk(len(inputs))
 
     def consistency_term(self, real_images, y, m=0):
         if self.hparams.consistency_term_coefficient != 0:
             # TODO: Need to check if correct
-            d_x1, d_x1_ = self.discriminator.forward(real_images, y, dropout=0.5, intermediate_output=True)
-            d_x2, d_x2_ = self.discriminator.forward(real_images, y, dropout=0.5, intermediate_output=True)
+            # Both stochastic passes run as one forward over a duplicated batch, each copy gets its own dropout masks
+            if isinstance(real_images, list):
+                x = [torch.cat([scaled_images, scaled_images]) for scaled_images in real_images]
+            else:
+                x = torch.cat([real_images, real_images])
+
+            d_x, d_x_ = self.discriminator.forward(x, torch.cat([y, y]), dropout=0.5, intermediate_output=True, chunks=2)
+            d_x1, d_x2 = d_x.chunk(2)
+            d_x1_, d_x2_ = d_x_.chunk(2)
 
             consistency_term = torch.relu(torch.dist(d_x1, d_x2) + 0.1 * torch.dist(d_x1_, d_x2_) - m)
 
@@ -297,37 +361,96 @@ class GAN(pl.LightningModule):
         self.discriminator.train(optimizer_idx == 0)
         self.generator.train(optimizer_idx == 1)
 
+        # Only the optimized network needs weight gradients, the other one just passes input gradients through.
+        # Lightning already toggles this per optimizer, it only matters for loops outside of it like benchmark.py
+        self.discriminator.requires_grad_(optimizer_idx == 0)
+        self.generator.requires_grad_(optimizer_idx == 1)
+
+        self.prepare_batch(batch, batch_idx)
+
         if optimizer_idx == 0:  # Train discriminator
-            return self.training_step_discriminator(batch)
+            for _ in range(self.hparams.discriminator_steps - 1):
+                # Additional updates on the same batch, the last one is done by lightning
+                optimizer = self.trainer.optimizers[optimizer_idx]
+                self.backward(self.trainer, self.training_step_discriminator()["loss"], optimizer, optimizer_idx)
+                self.on_after_backward()
 
-        if optimizer_idx == 1:  # Train generator
-            return self.training_step_generator(batch)
+                # Same clipping lightning applies before its own step
+                if getattr(self.trainer, "gradient_clip_val", 0) > 0:
+                    self.trainer.clip_gradients()
 
-    def training_step_discriminator(self, batch):
-        self.real_images, self.y = batch
+                self.optimizer_step(self.current_epoch, batch_idx, optimizer, optimizer_idx)
 
-        noise = torch.randn(self.real_images.size(0), self.hparams.noise_size, device=self.real_images.device)
+            return self.training_step_discriminator()
 
-        if self.hparams.multi_scale_gradient:
+        if optimizer_idx == 1:  # Train generator
+            if not self.generator_phase(batch_idx):
+                # Lightning needs a loss to call backward on, the generator does not run at all.
+                # The zero loss still enters lightning's running loss in the progress bar, the actual
+                # losses are the logged discriminator_loss and generator_loss
+                return OrderedDict({"loss": torch.zeros(1, device=self.real_images.device, requires_grad=True)})
+
+            return self.training_step_generator()
+
+    def generator_phase(self, batch_idx):
+        # The generator is trained every {self.alternation_interval} batches
+        return batch_idx % self.hparams.alternation_interval == 0
+
+    def prepare_batch(self, batch, batch_idx):
+        # Both optimizer passes of a batch share the normalized images and their pyramid
+        batch_key = (self.current_epoch, batch_idx)
+        if batch_key == self.batch_key:
+            return
+
+        images, self.y = batch
+        self.batch_key = batch_key
+
+        if isinstance(images, list):
+            # Pyramid precomputed by the dataset
+            self.scaled_real_images = [self.to_float_images(scaled_images) for scaled_images in images]
+            self.real_images = self.scaled_real_images[-1]
+        else:
+            self.real_images = self.to_float_images(images)
 
-            scaled_real_images = self.to_scaled_images(self.real_images)
+            if self.hparams.multi_scale_gradient:
+                self.scaled_real_images = self.to_scaled_images(self.real_images)
 
-            fake_images = [fake_image.detach() for fake_image in self.forward(noise, self.y)]
+    def training_step_discriminator(self):
+        noise = torch.randn(self.real_images.size(0), self.hparams.noise_size, device=self.real_images.device)
 
-            real_validity = self.discriminator(scaled_real_images, self.y)
-            fake_validity = self.discriminator(fake_images, self.y)
+        # The fake images are constants for the discriminator, no generator graph is built
+        with torch.no_grad():
+            fake_images = self.forward(noise, self.y, output_sizes=self.output_sizes())
 
-            # TODO: Need to check if gradient penalty works well
-            gradient_penalty = self.gradient_penalty(self.real_images, fake_images[-1], self.y)
-            consistency_term = self.consistency_term(scaled_real_images, self.y)
+        if self.hparams.multi_scale_gradient:
+            real_inputs = self.scaled_real_images
+            fake_inputs = fake_images
         else:
-            fake_images = [fake_image.detach() for fake_image in self.forward(noise, self.y)]
+            real_inputs = self.real_images
+            fake_inputs = fake_images[-1]
 
-            real_validity = self.discriminator(self.real_images, self.y)
-            fake_validity = self.discriminator(fake_images[-1], self.y)
+        regularize = self.regularization_step()
+        self.discriminator_step_count += 1
+
+        if self.hparams.fused_discriminator_forward:
+            real_validity, fake_validity = self.fused_discriminator([real_inputs, fake_inputs], self.y)
+        else:
+            real_validity = self.discriminator(real_inputs, self.y)
+            fake_validity = self.discriminator(fake_inputs, self.y)
+
+        if regularize:
+            # Interpolates get their own forward, fused with real and fake the double backward of the penalty would run over all of them
+            interpolates = self.interpolate(real_inputs, fake_inputs)
+            interpolates_size = interpolates[-1].size(0) if self.hparams.multi_scale_gradient else interpolates.size(0)
+            interpolates_validity = self.discriminator(interpolates, self.y[:interpolates_size])
+
+            # The coefficient is scaled by the interval, so the penalty keeps its strength on average
+            gradient_penalty = self.hparams.gradient_penalty_interval * self.penalty(interpolates, interpolates_validity)
+            self.amortized_gradient_penalty = gradient_penalty.detach() / self.hparams.gradient_penalty_interval
+        else:
+            gradient_penalty = 0
 
-            gradient_penalty = self.gradient_penalty(self.real_images, fake_images[-1], self.y)
-            consistency_term = self.consistency_term(self.real_images, self.y)
+        consistency_term = self.consistency_term(real_inputs, self.y)
 
         loss = self.discriminator_loss(real_validity, fake_validity)
 
@@ -336,26 +459,29 @@ class GAN(pl.LightningModule):
         else:
             discriminator_lr = self.hparams.discriminator_learning_rate
 
-        logs = {"discriminator_loss": loss, "gradient_penalty": gradient_penalty, "consistency_term": consistency_term, "discriminator_lr": discriminator_lr}
+        logs = {"discriminator_loss": loss, "gradient_penalty": self.amortized_gradient_penalty, "consistency_term": consistency_term, "discriminator_lr": discriminator_lr}
         return OrderedDict({"loss": loss + gradient_penalty, "log": logs, "progress_bar": logs})
 
-    def training_step_generator(self, batch):
-        self.real_images, self.y = batch
-
+    def training_step_generator(self):
         noise = torch.randn(self.real_images.size(0), self.hparams.noise_size, device=self.real_images.device)
 
         if self.hparams.multi_scale_gradient:
-            scaled_real_images = self.to_scaled_images(self.real_images)
             fake_images = self.forward(noise, self.y)
-
-            real_validity = self.discriminator(scaled_real_images, self.y)
             fake_validity = self.discriminator(fake_images, self.y)
         else:
-            fake_images = self.forward(noise, self.y)
-
-            real_validity = self.discriminator(self.real_images, self.y)
+            fake_images = self.forward(noise, self.y, output_sizes=self.output_sizes())
             fake_validity = self.discriminator(fake_images[-1], self.y)
 
+        if self.relativistic_loss():
+            # The real branch does not depend on the generator, so no graph is needed
+            with torch.no_grad():
+                if self.hparams.multi_scale_gradient:
+                    real_validity = self.discriminator(self.scaled_real_images, self.y)
+                else:
+                    real_validity = self.discriminator(self.real_images, self.y)
+        else:
+            real_validity = None
+
         loss = self.generator_loss(real_validity, fake_validity)
 
         if len(self.trainer.lr_schedulers) >= 2:
@@ -366,6 +492,13 @@ class GAN(pl.LightningModule):
         logs = {"generator_loss": loss, "generator_lr": generator_lr}
         return OrderedDict({"loss": loss, "log": logs, "progress_bar": logs})
 
+    def to_float_images(self, images):
+        # Datasets deliver uint8 to save worker time and IPC bandwidth, normalize the whole batch at once to [-1, 1]
+        if images.dtype == torch.uint8:
+            return images.float().div_(127.5).sub_(1.0)
+
+        return images
+
     def to_scaled_images(self, source_images):
         return [
             *[
@@ -384,7 +517,7 @@ class GAN(pl.LightningModule):
                     noise = torch.randn(self.hparams.batch_size, self.hparams.noise_size, device=self.real_images.device)
                     y = torch.randint(0, 9, (self.hparams.batch_size,), device=self.real_images.device)
 
-                    fake_images = self.forward(noise, y)[-1].detach()
+                    fake_images = self.forward(noise, y, output_sizes=[self.hparams.image_size])[-1].detach()
                     fake_images = F.interpolate(fake_images, (299, 299))
 
                     if fake_images.size(1) == 1:
@@ -406,7 +539,7 @@ class GAN(pl.LightningModule):
 
                 noise = torch.rand(grid_size ** 2, self.hparams.noise_size, device=self.real_images.device)
                 y = torch.tensor(range(grid_size), device=self.real_images.device).repeat(grid_size)
-                fake_images = self.forward(noise, y)[-1].detach()
+                fake_images = self.forward(noise, y, output_sizes=[self.hparams.image_size])[-1].detach()
 
                 grid = torchvision.utils.make_grid(fake_images, nrow=grid_size, padding=0)
 
@@ -436,7 +569,7 @@ class GAN(pl.LightningModule):
 
                 noise = torch.rand(grid_size ** 2, self.hparams.noise_size, device=self.real_images.device)
                 y = torch.tensor(range(grid_size), device=self.real_images.device).repeat(grid_size)
-                fake_images = self.forward(noise, y)[-1].detach()
+                fake_images = self.forward(noise, y, output_sizes=[self.hparams.image_size])[-1].detach()
 
                 grid = torchvision.utils.make_grid(fake_images, nrow=grid_size, padding=0)
 
@@ -451,13 +584,15 @@ class GAN(pl.LightningModule):
         # update discriminator opt every step
         if optimizer_idx == 0:  optimizer.step()
         # update generator opt every {self.alternation_interval} steps
-        if optimizer_idx == 1 and batch_idx % self.hparams.alternation_interval == 0: optimizer.step()
+        if optimizer_idx == 1 and self.generator_phase(batch_idx): optimizer.step()
 
         optimizer.zero_grad()
 
     def configure_optimizers(self):
-        discriminator_optimizer = OAdam(self.discriminator.parameters(), lr=self.hparams.discriminator_learning_rate, betas=(self.hparams.discriminator_beta1, self.hparams.discriminator_beta2))
-        generator_optimizer = OAdam(self.generator.parameters(), lr=self.hparams.generator_learning_rate, betas=(self.hparams.generator_beta1, self.hparams.generator_beta2))
+        state_dtype = None if self.hparams.optimizer_state == "fp32" else self.hparams.optimizer_state
+
+        discriminator_optimizer = OAdam(self.discriminator.parameters(), lr=self.hparams.discriminator_learning_rate, betas=(self.hparams.discriminator_beta1, self.hparams.discriminator_beta2), state_dtype=state_dtype)
+        generator_optimizer = OAdam(self.generator.parameters(), lr=self.hparams.generator_learning_rate, betas=(self.hparams.generator_beta1, self.hparams.generator_beta2), state_dtype=state_dtype)
 
         return [discriminator_optimizer, generator_optimizer]
 
@@ -470,9 +605,9 @@ class GAN(pl.LightningModule):
         # return [discriminator_optimizer, generator_optimizer], [discriminator_lr_scheduler, generator_lr_scheduler]
 
     def prepare_data(self):
+        # Normalization to [-1, 1] happens batch-wise in training_step
         train_resize = transforms.Resize((self.hparams.image_size, self.hparams.image_size))
-        train_normalize = transforms.Normalize(mean=[0.5], std=[0.5])
-        train_transform = transforms.Compose([train_resize, transforms.ToTensor(), train_normalize])
+        train_transform = transforms.Compose([train_resize, ToUint8Tensor()])
 
         if self.hparams.dataset == "mnist":
             self.train_dataset = MNIST(self.hparams.dataset_path, train=True, download=True, transform=train_transform)
@@ -490,11 +625,39 @@ class GAN(pl.LightningModule):
             self.train_dataset = LSUN(self.hparams.dataset_path + "/lsun", classes=[cls + "_train" for cls in self.hparams.dataset_classes], transform=train_transform)
             # self.test_dataset = LSUN(self.hparams.dataset_path, classes=[cls + "_test" for cls in self.hparams.dataset_classes], transform=test_transform)
         elif self.hparams.dataset == "celeba_hq":
-            self.train_dataset = CelebAHQ(self.hparams.dataset_path, image_size=self.hparams.image_size, transform=train_transform)
+            if self.hparams.dataset_packed:
+                self.train_dataset = PackedCelebAHQ(self.hparams.dataset_path, image_size=self.hparams.image_size)
+            else:
+                self.train_dataset = CelebAHQ(self.hparams.dataset_path, image_size=self.hparams.image_size, transform=train_transform, validate=self.hparams.dataset_validate)
         else:
             raise NotImplementedError("Custom dataset is not implemented yet")
 
+        if self.hparams.dataset_in_memory:
+            # Keeps the raw uint8 data resized once, the per-sample transform is bypassed
+            self.train_dataset = InMemoryImageDataset.from_torchvision(self.train_dataset, self.hparams.image_size)
+
+            if self.hparams.multi_scale_gradient:
+                # Batches are delivered as the same pyramid to_scaled_images would build
+                self.train_dataset.build_pyramid([2 ** target_size for target_size in range(2, int(math.log2(self.hparams.image_size)))])
+
     def train_dataloader(self):
+        if isinstance(self.train_dataset, InMemoryImageDataset):
+            return InMemoryDataLoader(
+                self.train_dataset,
+                batch_size=self.hparams.batch_size,
+                shuffle=True,
+                drop_last=True
+            )
+
+        if isinstance(self.train_dataset, PackedImageFolder):
+            # The packed dataset reads whole batches from the memory map itself
+            return DataLoader(
+                self.train_dataset,
+                num_workers=self.hparams.dataloader_num_workers,
+                batch_size=None,
+                sampler=BatchSampler(SequentialSampler(self.train_dataset), batch_size=self.hparams.batch_size, drop_last=True)
+            )
+
         return DataLoader(
             self.train_dataset,
             num_workers=self.hparams.dataloader_num_workers,
@@ -513,6 +676,7 @@ class GAN(pl.LightningModule):
         parser.add_argument("-cb2", "--discriminator-beta2", type=float, default=0.999, help="Momentum term beta2 of the discriminator optimizer")
         parser.add_argument("-gb1", "--generator-beta1", type=float, default=0.5, help="Momentum term beta1 of the generator optimizer")
         parser.add_argument("-gb2", "--generator-beta2", type=float, default=0.999, help="Momentum term beta2 of the generator optimizer")
+        parser.add_argument("-os", "--optimizer-state", type=str, choices=["fp32", "bf16", "int8"], default="fp32", help="Storage of the optimizer moment estimates")
         parser.add_argument("-v", "--score-iterations", type=int, default=0, help="Number of score iterations each epoch")
         parser.add_argument("-msg", "--multi-scale-gradient", action="store_true", help="Enable Multi-Scale Gradient")
         parser.add_argument("-a", "--architecture", type=str, choices=["progan", "hdcgan"], default="hdcgan")
@@ -527,6 +691,11 @@ class GAN(pl.LightningModule):
         parser.add_argument("-is", "--image-size", type=int, default=128, help="Generated image size")
         parser.add_argument("-bs", "--batch-size", type=int, default=32, help="Batch size")
         parser.add_argument("-in", "--instance-noise", action="store_true", help="Add instance noise")
+        parser.add_argument("-fdf", "--fused-discriminator-forward", action="store_true", help="Run the discriminator once over real and fake images")
+        parser.add_argument("-mgs", "--minibatch-std-dev-group-size", type=int, default=None, help="Number of samples sharing one minibatch standard deviation, the whole batch if not set")
+        parser.add_argument("-zsc", "--z-skip-connections", action="store_true", help="Add a 1x1 conv of the noise, viewed as 8x8 maps, to the output of every generator block from 8x8 on")
+        parser.add_argument("-fus", "--fused-upsample", action="store_true", help="Upsample and convolve in one transposed conv inside the generator blocks (HDCGAN only)")
+        parser.add_argument("-fds", "--fused-downsample", action="store_true", help="Downsample inside the discriminator blocks with a strided conv (HDCGAN) or average pooling (ProGAN)")
 
         # TTUR: https://arxiv.org/abs/1706.08500
         parser.add_argument("-clr", "--discriminator-learning-rate", type=float, default=1e-4, help="Learning rate of the discriminator optimizers")
@@ -545,9 +714,12 @@ class GAN(pl.LightningModule):
         parser.add_argument("-z", "--noise-size", type=int, default=128, help="Length of the noise vector")
         parser.add_argument("-y", "--y-size", type=int, default=1, help="Length of the y/label vector")
         parser.add_argument("-yes", "--y-embedding-size", type=int, default=10, help="Length of the y/label embedding vector")
-        parser.add_argument("-k", "--alternation-interval", type=int, default=1, help="Amount of steps the discriminator is trained for each training step of the generator")
+        parser.add_argument("-k", "--alternation-interval", type=int, default=1, help="Amount of steps the discriminator is trained for each training step of the generator, skipped generator steps report a zero loss to the running loss of the progress bar")
+        parser.add_argument("-ds", "--discriminator-steps", type=int, default=1, help="Amount of discriminator updates on each batch, can not be combined with gradient accumulation")
         parser.add_argument("-gpc", "--gradient-penalty-coefficient", type=float, default=None, help="Gradient penalty coefficient")
         parser.add_argument("-gpp", "--gradient-penalty-power", type=float, default=None, help="Gradient penalty coefficient")
+        parser.add_argument("-gpi", "--gradient-penalty-interval", type=int, default=1, help="Gradient penalty is computed every n discriminator steps with its coefficient scaled by n")
+        parser.add_argument("-gpf", "--gradient-penalty-batch-fraction", type=float, default=1.0, help="Fraction of the batch the gradient penalty is computed on")
         parser.add_argument("-ctw", "--consistency-term-coefficient", type=float, default=None, help="Consistency term coefficient")
         parser.add_argument("-wc", "--weight-clipping", type=float, default=0.01, help="Weights of the discriminator gets clipped at this point")
 
@@ -557,5 +729,8 @@ class GAN(pl.LightningModule):
         parser.add_argument("--dataset", type=str, choices=["custom", "cifar10", "mnist", "fashion_mnist", "lsun", "image_net", "celeba_hq"], required=True)
         parser.add_argument("--dataset-path", type=str, default=os.getcwd() + "/.datasets")
         parser.add_argument("--dataset-classes", type=int, nargs="+", default=["church_outdoor"])
+        parser.add_argument("--dataset-packed", action="store_true", help="Serve the dataset from a pre-resized memory-mapped uint8 cache")
+        parser.add_argument("--dataset-validate", action="store_true", help="Decode every image once while indexing the dataset and drop corrupt ones")
+        parser.add_argument("--dataset-in-memory", action="store_true", help="Hold the whole dataset as one resized uint8 tensor (mnist, fashion_mnist, cifar10)")
 
         return parser
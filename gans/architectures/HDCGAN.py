@@ -43,17 +43,27 @@ class FirstHDCGANBlock(nn.Module):
 
 
 class UpsampleHDCGANBlock(nn.Module):
-    def __init__(self, in_channels, out_channels, bias=False):
+    def __init__(self, in_channels, out_channels, bias=False, fused=False):
         super().__init__()
 
-        self.conv1 = nn.Conv2d(
-            in_channels,
-            out_channels,
-            kernel_size=3,
-            stride=1,
-            padding=1,
-            bias=bias
-        )
+        # Upsampling and conv1 in one transposed conv, the upsampled input is never materialized
+        self.fused = fused
+
+        if fused:
+            self.conv1 = bb.NearestUpsampleConv2d(
+                in_channels,
+                out_channels,
+                bias=bias
+            )
+        else:
+            self.conv1 = nn.Conv2d(
+                in_channels,
+                out_channels,
+                kernel_size=3,
+                stride=1,
+                padding=1,
+                bias=bias
+            )
 
         self.conv2 = nn.Conv2d(
             out_channels,
@@ -67,14 +77,15 @@ class UpsampleHDCGANBlock(nn.Module):
         # self.norm = bb.PixelNorm()
 
     def forward(self, x):
-        x = F.interpolate(
-            x,
-            size=(
-                x.size(2) * 2,
-                x.size(3) * 2
-            ),
-            mode="nearest"
-        )
+        if not self.fused:
+            x = F.interpolate(
+                x,
+                size=(
+                    x.size(2) * 2,
+                    x.size(3) * 2
+                ),
+                mode="nearest"
+            )
 
         x = self.conv1(x)
         F.selu(x, inplace=True)
@@ -88,10 +99,10 @@ class UpsampleHDCGANBlock(nn.Module):
 
 
 class LastHDCGANBlock(nn.Module):
-    def __init__(self, in_channels, out_channels, additional_channels, bias=False):
+    def __init__(self, in_channels, out_channels, additional_channels, bias=False, group_size=None):
         super().__init__()
 
-        self.miniBatchStdDev = bb.MinibatchStdDev()
+        self.miniBatchStdDev = bb.MinibatchStdDev(group_size=group_size)
 
         self.conv1 = nn.Conv2d(
             in_channels + additional_channels + 1,
@@ -120,8 +131,8 @@ class LastHDCGANBlock(nn.Module):
             bias=bias
         )
 
-    def forward(self, x):
-        x = self.miniBatchStdDev(x)
+    def forward(self, x, chunks=1):
+        x = self.miniBatchStdDev(x, chunks=chunks)
         x = self.conv1(x)
         F.selu(x, inplace=True)
         x = self.conv2(x)
@@ -132,9 +143,12 @@ class LastHDCGANBlock(nn.Module):
 
 
 class DownsampleHDCGANBlock(nn.Module):
-    def __init__(self, in_channels, out_channels, bias=False):
+    def __init__(self, in_channels, out_channels, bias=False, fused=False):
         super().__init__()
 
+        # Nearest downsampling keeps every second output of conv2, a strided conv2 computes only those
+        self.fused = fused
+
         self.conv1 = nn.Conv2d(
             in_channels,
             in_channels,
@@ -148,7 +162,7 @@ class DownsampleHDCGANBlock(nn.Module):
             in_channels,
             out_channels,
             kernel_size=3,
-            stride=1,
+            stride=2 if fused else 1,
             padding=1,
             bias=bias
         )
@@ -159,6 +173,9 @@ class DownsampleHDCGANBlock(nn.Module):
         x = self.conv2(x)
         F.selu(x, inplace=True)
 
+        if self.fused:
+            return x
+
         x = F.interpolate(
             x,
             size=(
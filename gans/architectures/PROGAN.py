@@ -99,11 +99,11 @@ class UpsampleProGANBlock(nn.Module):
 
 
 class LastProGANBlock(nn.Module):
-    def __init__(self, in_channels, out_channels, additional_channels, bias=False, eq_lr=False, spectral_normalization=False):
+    def __init__(self, in_channels, out_channels, additional_channels, bias=False, eq_lr=False, spectral_normalization=False, group_size=None):
         super().__init__()
 
         self.block = nn.Sequential(
-            bb.MinibatchStdDev(),
+            bb.MinibatchStdDev(group_size=group_size),
             bb.Conv2d(
                 in_channels + additional_channels + 1,
                 out_channels + additional_channels,
@@ -138,14 +138,17 @@ class LastProGANBlock(nn.Module):
             )
         )
 
-    def forward(self, x):
+    def forward(self, x, chunks=1):
         return x
 
 
 class DownsampleProGANBlock(nn.Module):
-    def __init__(self, in_channels, out_channels, bias=False, eq_lr=False, spectral_normalization=False, position=None):
+    def __init__(self, in_channels, out_channels, bias=False, eq_lr=False, spectral_normalization=False, position=None, fused=False):
         super().__init__()
 
+        # Bilinear downsampling by exactly 2 averages each 2x2 window, which average pooling does directly
+        self.fused = fused
+
         self.conv1 = nn.Sequential(
             bb.Conv2d(
                 in_channels,
@@ -177,6 +180,9 @@ class DownsampleProGANBlock(nn.Module):
         x = self.conv1(x)
         x = self.conv2(x)
 
+        if self.fused:
+            return F.avg_pool2d(x, kernel_size=2)
+
         x = F.interpolate(
             x,
             size=(
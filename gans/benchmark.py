@@ -0,0 +1,323 @@
+import copy
+import multiprocessing
+import queue
+import resource
+import time
+from argparse import ArgumentParser
+from types import SimpleNamespace
+
+import torch
+
+import gans.building_blocks as bb
+from gans.applications import GAN
+from gans.building_blocks.attention import TiledAttention
+from gans.models import Generator, Discriminator
+from gans.optim import OAdam
+
+SEED = 1337
+
+
+def peak_memory(device):
+    if device.type == "cuda":
+        return torch.cuda.max_memory_allocated(device) / 2 ** 20
+
+    # ru_maxrss is given in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+
+def synchronize(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def pixel_norm_reference(x, alpha=1e-8):
+    return x / (x ** 2).mean(dim=1, keepdim=True).add(alpha).sqrt()
+
+
+def minibatch_std_dev_reference(x, alpha=1e-8):
+    batch_size, _, height, width = x.shape
+
+    y = x - x.mean(dim=0, keepdim=True)
+    y = torch.sqrt(y.pow(2.).mean(dim=0, keepdim=False) + alpha).mean()
+    y = y.view(1, 1, 1, 1).repeat(batch_size, 1, height, width)
+
+    return torch.cat([x, y], 1)
+
+
+def benchmark_layer(fn, x, steps, warmup_steps):
+    """
+    Times forward and backward passes of a layer function
+    :return: milliseconds per pass, peak memory in MiB on CUDA, the output of the last pass
+    """
+    x = x.detach().requires_grad_()
+
+    if x.device.type == "cuda":
+        torch.cuda.reset_max_memory_allocated(x.device)
+
+    for step in range(warmup_steps + steps):
+        if step == warmup_steps:
+            synchronize(x.device)
+            start = time.perf_counter()
+
+        output = fn(x)
+        output.sum().backward()
+        x.grad = None
+
+    synchronize(x.device)
+    elapsed = time.perf_counter() - start
+
+    memory = peak_memory(x.device) if x.device.type == "cuda" else float("nan")
+
+    return 1000 * elapsed / steps, memory, output.detach()
+
+
+def benchmark_layers(hparams):
+    torch.manual_seed(SEED)
+    device = torch.device(hparams.device)
+
+    # Activations of the first ProGAN block and of the discriminator head at the configured sizes
+    activations = torch.randn(hparams.batch_size, hparams.generator_filters, hparams.image_size, hparams.image_size, device=device)
+    head = torch.randn(hparams.batch_size, hparams.discriminator_filters, 4, 4, device=device)
+
+    layers = [
+        ("pixel_norm", pixel_norm_reference, bb.PixelNorm(), activations),
+        ("minibatch_std_dev", minibatch_std_dev_reference, bb.MinibatchStdDev(), head)
+    ]
+
+    print("{:<20} {:>14} {:>14} {:>10} {:>14} {:>14} {:>12}".format("layer", "reference ms", "current ms", "speedup", "reference MiB", "current MiB", "max error"))
+
+    for name, reference, layer, x in layers:
+        reference_ms, reference_memory, expected = benchmark_layer(reference, x, hparams.steps, hparams.warmup_steps)
+        current_ms, current_memory, actual = benchmark_layer(layer, x, hparams.steps, hparams.warmup_steps)
+
+        print("{:<20} {:>14.3f} {:>14.3f} {:>9.2f}x {:>14.1f} {:>14.1f} {:>12.2e}".format(
+            name,
+            reference_ms,
+            current_ms,
+            reference_ms / current_ms,
+            reference_memory,
+            current_memory,
+            (expected - actual).abs().max().item()
+        ))
+
+
+def check_optimizer_states(hparams, size=65536, tolerance=0.05):
+    """
+    Follows fp32 OAdam with the compact optimizer states on gradients shrinking by three orders of magnitude,
+    which second moment estimates that can not decrease would turn into much too small updates
+    """
+    initial = torch.randn(size, generator=torch.Generator().manual_seed(SEED))
+    results = {}
+
+    for state_dtype in [None, "bf16", "int8"]:
+        torch.manual_seed(SEED)
+        parameter = torch.nn.Parameter(initial.clone())
+        optimizer = OAdam([parameter], lr=1e-3, state_dtype=state_dtype)
+        generator = torch.Generator().manual_seed(SEED)
+        last_updates = torch.zeros(size)
+
+        for step in range(hparams.steps):
+            previous = parameter.detach().clone()
+            parameter.grad = torch.randn(size, generator=generator) * 10 ** (-3 * step / hparams.steps)
+            optimizer.step()
+
+            if step >= hparams.steps - 100:
+                last_updates += (parameter.detach() - previous).abs()
+
+        results[state_dtype] = parameter.detach(), last_updates
+
+    reference, reference_updates = results[None]
+
+    print("{:<12} {:>18} {:>22} {:>10}".format("state dtype", "relative deviation", "late update ratio", "status"))
+
+    for state_dtype in ["bf16", "int8"]:
+        parameter, last_updates = results[state_dtype]
+        deviation = ((parameter - reference).norm() / (reference - initial).norm()).item()
+        update_ratio = (last_updates.sum() / reference_updates.sum()).item()
+
+        print("{:<12} {:>18.4f} {:>22.4f} {:>10}".format(
+            state_dtype,
+            deviation,
+            update_ratio,
+            "ok" if deviation < tolerance and abs(update_ratio - 1) < tolerance else "deviates"
+        ))
+
+
+def check_multi_tensor_step(hparams, tolerance=1e-5):
+    """
+    Compares the multi tensor update of OAdam with the per parameter one on several differently sized parameters
+    """
+    if not hasattr(torch, "_foreach_addcdiv_"):
+        print("multi tensor step   skipped, torch {} has no multi tensor operations".format(torch.__version__))
+        return
+
+    generator = torch.Generator().manual_seed(SEED)
+    initial = [torch.randn(size, generator=generator) for size in [(64, 32, 3, 3), (64,), (1000,)]]
+
+    for amsgrad in [False, True]:
+        results = []
+
+        for foreach in [False, True]:
+            parameters = [torch.nn.Parameter(tensor.clone()) for tensor in initial]
+            optimizer = OAdam(parameters, lr=1e-3, weight_decay=1e-4, amsgrad=amsgrad, foreach=foreach)
+            gradients = torch.Generator().manual_seed(SEED)
+
+            for _ in range(hparams.steps):
+                for parameter in parameters:
+                    parameter.grad = torch.randn(parameter.shape, generator=gradients)
+
+                optimizer.step()
+
+            results.append(parameters)
+
+        error = max((single - multi).abs().max().item() for single, multi in zip(*results))
+
+        print("multi tensor step   amsgrad={:<6} max error {:.2e} {:>10}".format(str(amsgrad), error, "ok" if error < tolerance else "deviates"))
+
+
+def attention_reference(f, g, h):
+    return torch.bmm(h, torch.softmax(torch.bmm(f.transpose(1, 2), g), 2))
+
+
+def check_attention(hparams, tile_size=4, tolerance=1e-10):
+    """
+    Checks the hand written backward of the tiled attention with float64 gradcheck and gradgradcheck and
+    compares its output and gradients with the untiled attention. The number of positions is not a multiple
+    of the tile size, so the last tile is a partial one
+    """
+    generator = torch.Generator().manual_seed(SEED)
+    f, g, h = [torch.randn(2, 3, 10, generator=generator, dtype=torch.float64, requires_grad=True) for _ in range(3)]
+
+    def tiled(f, g, h):
+        return TiledAttention.apply(f, g, h, tile_size)
+
+    print("{:<24} {:>10}".format("attention check", "status"))
+    print("{:<24} {:>10}".format("gradcheck", "ok" if torch.autograd.gradcheck(tiled, (f, g, h), raise_exception=False) else "fails"))
+    print("{:<24} {:>10}".format("gradgradcheck", "ok" if torch.autograd.gradgradcheck(tiled, (f, g, h), raise_exception=False) else "fails"))
+
+    grad_v = torch.randn(2, 3, 10, generator=generator, dtype=torch.float64)
+    results = []
+
+    for fn in [attention_reference, tiled]:
+        v = fn(f, g, h)
+        results.append([v.detach()] + list(torch.autograd.grad(v, (f, g, h), grad_v)))
+
+    for name, expected, actual in zip(["output", "grad f", "grad g", "grad h"], *results):
+        error = (expected - actual).abs().max().item()
+
+        print("{:<24} {:>10} max error {:.2e}".format("untiled " + name, "ok" if error < tolerance else "deviates", error))
+
+
+def benchmark_training(hparams, results):
+    """
+    Runs training steps of both optimizers on random uint8 batches and reports the throughput and peak memory.
+    Runs in its own process, so the peak memory is not shared between configurations
+    """
+    torch.manual_seed(SEED)
+    device = torch.device(hparams.device)
+
+    model = GAN(hparams, Generator(hparams), Discriminator(hparams)).to(device)
+    optimizers = model.configure_optimizers()
+
+    # The parts of the trainer the training step uses
+    model.trainer = SimpleNamespace(lr_schedulers=[], optimizers=optimizers, precision=32, use_amp=False, use_native_amp=False)
+
+    images = torch.randint(0, 256, (hparams.batch_size, hparams.image_channels, hparams.image_size, hparams.image_size), dtype=torch.uint8, device=device)
+    y = torch.zeros(hparams.batch_size, dtype=torch.long, device=device)
+
+    start = time.perf_counter()
+    for batch_idx in range(hparams.warmup_steps + hparams.steps):
+        if batch_idx == hparams.warmup_steps:
+            synchronize(device)
+            start = time.perf_counter()
+
+        for optimizer_idx, optimizer in enumerate(optimizers):
+            output = model.training_step((images, y), batch_idx, optimizer_idx)
+            model.backward(model.trainer, output["loss"], optimizer, optimizer_idx)
+            model.optimizer_step(model.current_epoch, batch_idx, optimizer, optimizer_idx)
+
+    synchronize(device)
+    elapsed = time.perf_counter() - start
+
+    results.put({
+        "images_per_second": hparams.steps * hparams.batch_size / elapsed,
+        "peak_memory": peak_memory(device)
+    })
+
+
+def wait_for_result(process, results):
+    """
+    Waits for the result of a benchmark process
+    :return: the result or None if the process exited without one
+    """
+    while True:
+        try:
+            return results.get(timeout=1)
+        except queue.Empty:
+            if not process.is_alive():
+                # The result may have been put right before exiting
+                try:
+                    return results.get(timeout=1)
+                except queue.Empty:
+                    return None
+
+
+def main(hparams):
+    context = multiprocessing.get_context("spawn")
+    baseline = None
+
+    print("{:<16} {:>12} {:>10} {:>16}".format("optimizer state", "images/s", "speedup", "peak memory MiB"))
+
+    for optimizer_state in hparams.compare_optimizer_states:
+        run_hparams = copy.deepcopy(hparams)
+        run_hparams.optimizer_state = optimizer_state
+
+        results = context.Queue()
+        process = context.Process(target=benchmark_training, args=(run_hparams, results))
+        process.start()
+        result = wait_for_result(process, results)
+        process.join()
+
+        if result is None:
+            print("{:<16} failed with exit code {}".format(optimizer_state, process.exitcode))
+            continue
+
+        if baseline is None:
+            baseline = result
+
+        print("{:<16} {:>12.2f} {:>9.2f}x {:>16.1f}".format(
+            optimizer_state,
+            result["images_per_second"],
+            result["images_per_second"] / baseline["images_per_second"],
+            result["peak_memory"]
+        ))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(add_help=False)
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--warmup-steps", type=int, default=3)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--optimizer-states", action="store_true", help="Check that the compact optimizer states and the multi tensor update follow fp32 per parameter OAdam for --steps steps, e.g. --steps 1000")
+    parser.add_argument("--attention", action="store_true", help="Check the gradients of the tiled self attention in float64 and compare it with the untiled attention")
+    parser.add_argument("--layers", action="store_true", help="Microbenchmark single layers against their reference implementations instead of training steps")
+    parser.add_argument("--compare-optimizer-states", type=str, nargs="+", choices=["fp32", "bf16", "int8"], default=["fp32", "bf16", "int8"])
+
+    parser = GAN.add_model_specific_args(parser)
+
+    hparams = parser.parse_args()
+
+    if hparams.dataset == "mnist" or hparams.dataset == "fashion_mnist":
+        hparams.image_channels = 1
+    elif hparams.dataset == "cifar10":
+        hparams.image_channels = 3
+
+    if hparams.optimizer_states:
+        check_optimizer_states(hparams)
+        check_multi_tensor_step(hparams)
+    elif hparams.attention:
+        check_attention(hparams)
+    elif hparams.layers:
+        benchmark_layers(hparams)
+    else:
+        main(hparams)
@@ -1,4 +1,5 @@
 from .attention import SelfAttention2d
 from .minibatch_std_dev import MinibatchStdDev
 from .pixel_norm import PixelNorm
-from .convolution import Conv2d, ConvTranspose2d, SubPixelConv2d, _ConvTranspose2d, _Conv2d
+from .convolution import Conv2d, ConvTranspose2d, SubPixelConv2d, NearestUpsampleConv2d, _ConvTranspose2d, _Conv2d, freeze_equalized_learning_rate
+from .spectral_norm import spectral_norm, freeze_spectral_norm
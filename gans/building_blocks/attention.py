@@ -4,25 +4,105 @@ import torch.nn as nn
 from .convolution import Conv2d
 
 
+def attention_tiles(f, g, tile_size):
+    # Rows of s = f^T g are normalized independently, so each tile of rows gives complete softmax rows
+    for start in range(0, f.size(2), tile_size):
+        end = start + tile_size
+        beta = torch.softmax(torch.bmm(f[:, :, start:end].transpose(1, 2), g), 2)
+
+        yield start, end, beta
+
+
+class TiledAttention(torch.autograd.Function):
+    """
+    Computes v = h softmax(f^T g) tile by tile. Forward and backward only keep one tile of the N x N
+    attention matrix alive, the backward recomputes the tiles instead of saving them. The backward is
+    built from differentiable operations, so double backward (gradient penalties) works, but the graph
+    it records keeps the recomputed tiles alive and then needs memory quadratic in N again
+    """
+
+    @staticmethod
+    def forward(ctx, f, g, h, tile_size):
+        ctx.save_for_backward(f, g, h)
+        ctx.tile_size = tile_size
+
+        v = None
+        for start, end, beta in attention_tiles(f, g, tile_size):
+            contribution = torch.bmm(h[:, :, start:end], beta)
+            v = contribution if v is None else v.add_(contribution)
+
+        return v
+
+    @staticmethod
+    def backward(ctx, grad_v):
+        f, g, h = ctx.saved_tensors
+
+        grad_f, grad_g, grad_h = [], None, []
+        for start, end, beta in attention_tiles(f, g, ctx.tile_size):
+            grad_h.append(torch.bmm(grad_v, beta.transpose(1, 2)))
+
+            # Softmax backward over the rows of the tile
+            grad_beta = torch.bmm(h[:, :, start:end].transpose(1, 2), grad_v)
+            grad_s = beta * (grad_beta - (grad_beta * beta).sum(dim=2, keepdim=True))
+
+            grad_f.append(torch.bmm(g, grad_s.transpose(1, 2)))
+            contribution = torch.bmm(f[:, :, start:end], grad_s)
+
+            # Out of place, the backward may itself be differentiated
+            grad_g = contribution if grad_g is None else grad_g + contribution
+
+        return torch.cat(grad_f, dim=2), grad_g, torch.cat(grad_h, dim=2), None
+
+
 class SelfAttention2d(nn.Module):
-    def __init__(self, in_channels, k=8, bias=False, eq_lr=False, spectral_normalization=False):
+    def __init__(self, in_channels, k=8, bias=False, eq_lr=False, spectral_normalization=False, tile_size=256):
+        """
+        :param in_channels: number of input channels
+        :param k: reduction factor of the query, key and value channels
+        :param tile_size: number of positions whose attention scores are materialized at once
+        """
         super().__init__()
 
-        self.wf = Conv2d(in_channels, in_channels // k, kernel_size=1, stride=1, padding=0, bias=bias, eq_lr=eq_lr, spectral_normalization=spectral_normalization)
-        self.wg = Conv2d(in_channels, in_channels // k, kernel_size=1, stride=1, padding=0, bias=bias, eq_lr=eq_lr, spectral_normalization=spectral_normalization)
-        self.wh = Conv2d(in_channels, in_channels // k, kernel_size=1, stride=1, padding=0, bias=bias, eq_lr=eq_lr, spectral_normalization=spectral_normalization)
-        self.wv = Conv2d(in_channels // k, in_channels, kernel_size=1, stride=1, padding=0, bias=bias, eq_lr=eq_lr, spectral_normalization=spectral_normalization)
+        self.projection_channels = in_channels // k
+        self.tile_size = tile_size
+        self.fused = not spectral_normalization
+
+        if self.fused:
+            # f, g and h in one conv, they share input and fan in, so the equalized learning rate scale is the same
+            self.wfgh = Conv2d(in_channels, 3 * self.projection_channels, kernel_size=1, stride=1, padding=0, bias=bias, eq_lr=eq_lr, spectral_normalization=False)
+        else:
+            # Spectral normalization of the fused weight would use one sigma for all three projections
+            self.wf = Conv2d(in_channels, self.projection_channels, kernel_size=1, stride=1, padding=0, bias=bias, eq_lr=eq_lr, spectral_normalization=spectral_normalization)
+            self.wg = Conv2d(in_channels, self.projection_channels, kernel_size=1, stride=1, padding=0, bias=bias, eq_lr=eq_lr, spectral_normalization=spectral_normalization)
+            self.wh = Conv2d(in_channels, self.projection_channels, kernel_size=1, stride=1, padding=0, bias=bias, eq_lr=eq_lr, spectral_normalization=spectral_normalization)
+
+        self.wv = Conv2d(self.projection_channels, in_channels, kernel_size=1, stride=1, padding=0, bias=bias, eq_lr=eq_lr, spectral_normalization=spectral_normalization)
 
         self.gamma = nn.Parameter(torch.zeros(1), requires_grad=True)
 
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # Checkpoints with separate f, g and h projections are merged into the fused conv
+        if self.fused and prefix + "wf.conv.weight" in state_dict:
+            for name in ["weight", "bias"]:
+                keys = [prefix + projection + ".conv." + name for projection in ["wf", "wg", "wh"]]
+
+                if keys[0] in state_dict:
+                    state_dict[prefix + "wfgh.conv." + name] = torch.cat([state_dict.pop(key) for key in keys])
+
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
     def forward(self, x):
-        f = self.wf(x).view(x.size(0), -1, x.size(2) * x.size(3))
-        g = self.wg(x).view(x.size(0), -1, x.size(2) * x.size(3))
-        h = self.wh(x).view(x.size(0), -1, x.size(2) * x.size(3))
-        s = torch.bmm(f.transpose(1, 2), g)
-        beta = torch.softmax(s, 2)
-
-        v = torch.bmm(h, beta).view(x.size(0), -1, x.size(2), x.size(3))
-        o = self.wv(v)
+        batch_size, channels, height, width = x.shape
+
+        if self.fused:
+            f, g, h = self.wfgh(x).view(batch_size, 3, self.projection_channels, height * width).unbind(1)
+        else:
+            f = self.wf(x).view(batch_size, -1, height * width)
+            g = self.wg(x).view(batch_size, -1, height * width)
+            h = self.wh(x).view(batch_size, -1, height * width)
+
+        v = TiledAttention.apply(f, g, h, self.tile_size)
+
+        o = self.wv(v.view(batch_size, -1, height, width))
 
         return self.gamma * o + x
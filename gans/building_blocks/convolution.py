@@ -4,7 +4,8 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from torch.nn.modules.utils import _pair
-from torch.nn.utils import spectral_norm
+
+from .spectral_norm import spectral_norm
 
 
 class SubPixelConv2d(nn.Module):
@@ -78,22 +79,86 @@ class ConvTranspose2d(nn.Module):
         return self.convTranspose(x)
 
 
-class _Conv2d(nn.Conv2d):
+class _EqualizedLearningRate:
+    """
+    Equalized learning rate for conv modules with a weight_scale. Forwards that build no graph cache the scaled
+    weight and bias until the parameters change, which an optimizer step or loading a checkpoint does in place.
+    Forwards that build a graph always scale again, a cached graph could be backpropagated through a second
+    time without a step in between, e.g. with gradient accumulation
+    """
+
+    def init_equalized_learning_rate(self, fan_in, eq_lr):
+        self.weight_scale = sqrt(2.0 / fan_in) if eq_lr else 1.0
+        self.scaled_cache = None
+
+    def scaled_parameters(self):
+        if self.weight_scale == 1.0:
+            return self.weight, self.bias
+
+        building_graph = torch.is_grad_enabled() and (self.weight.requires_grad or (self.bias is not None and self.bias.requires_grad))
+
+        if building_graph:
+            self.scaled_cache = None
+
+            return self.weight * self.weight_scale, None if self.bias is None else self.bias * self.weight_scale
+
+        # Weights computed by hooks like spectral norm are new tensors on every forward and never hit the cache
+        key = (
+            self.weight,
+            self.bias,
+            (self.weight._version, self.weight.data_ptr(), None if self.bias is None else self.bias._version)
+        )
+
+        if self.scaled_cache is None or not self.cache_key_matches(self.scaled_cache[0], key):
+            weight = self.weight * self.weight_scale
+            bias = None if self.bias is None else self.bias * self.weight_scale
+            self.scaled_cache = (key, weight, bias)
+
+        return self.scaled_cache[1], self.scaled_cache[2]
+
+    @staticmethod
+    def cache_key_matches(cached_key, key):
+        return cached_key[0] is key[0] and cached_key[1] is key[1] and cached_key[2] == key[2]
+
+    def freeze(self):
+        """
+        Folds the scale into the weights for inference, the module then uses its parameters directly
+        """
+        if "weight_orig" in self._parameters:
+            # Spectral norm divides by sigma, which cancels any scale folded into weight_orig
+            raise ValueError("Spectral normalization has to be frozen before the equalized learning rate")
+
+        with torch.no_grad():
+            self.weight.mul_(self.weight_scale)
+            if self.bias is not None:
+                self.bias.mul_(self.weight_scale)
+
+        self.weight_scale = 1.0
+        self.scaled_cache = None
+
+    def __getstate__(self):
+        # The cache is derived from the parameters and rebuilt on the next forward
+        state = self.__dict__.copy()
+        state["scaled_cache"] = None
+
+        return state
+
+
+class _Conv2d(_EqualizedLearningRate, nn.Conv2d):
     def __init__(self, in_channels, out_channels, kernel_size, stride=1, padding=0, dilation=1, groups=1, bias=True, padding_mode="zeros", eq_lr=False):
         super().__init__(in_channels, out_channels, kernel_size, stride, padding, dilation, groups, bias, padding_mode)
 
-        if eq_lr:
-            fan_in, _ = nn.init._calculate_fan_in_and_fan_out(self.weight)
-            self.weight_scale = sqrt(2.0 / fan_in)
-        else:
-            self.weight_scale = 1.0
+        fan_in, _ = nn.init._calculate_fan_in_and_fan_out(self.weight)
+        self.init_equalized_learning_rate(fan_in, eq_lr)
 
     def forward(self, x):
+        weight, bias = self.scaled_parameters()
+
         if self.padding_mode != "zeros":
             return F.conv2d(
                 F.pad(x, self._padding_repeated_twice, mode=self.padding_mode),
-                self.weight * self.weight_scale,
-                self.bias * self.weight_scale,
+                weight,
+                bias,
                 self.stride,
                 _pair(0),
                 self.dilation,
@@ -101,8 +166,8 @@ class _Conv2d(nn.Conv2d):
             )
         return F.conv2d(
             x,
-            self.weight * self.weight_scale,
-            self.bias * self.weight_scale,
+            weight,
+            bias,
             self.stride,
             self.padding,
             self.dilation,
@@ -110,29 +175,63 @@ class _Conv2d(nn.Conv2d):
         )
 
 
-class _ConvTranspose2d(nn.ConvTranspose2d):
+class _ConvTranspose2d(_EqualizedLearningRate, nn.ConvTranspose2d):
     def __init__(self, in_channels, out_channels, kernel_size, stride=1, padding=0, output_padding=0, groups=1, bias=True, dilation=1, padding_mode="zeros", eq_lr=True):
         super().__init__(in_channels, out_channels, kernel_size, stride, padding, output_padding, groups, bias, dilation, padding_mode)
 
-        if eq_lr:
-            fan_in = in_channels
-            self.weight_scale = sqrt(2.0 / fan_in)
-        else:
-            self.weight_scale = 1.0
+        self.init_equalized_learning_rate(in_channels, eq_lr)
 
     def forward(self, x, output_size=None):
         if self.padding_mode != "zeros":
             raise ValueError("Only `zeros` padding mode is supported for ConvTranspose2d")
 
         output_padding = self._output_padding(x, output_size, self.stride, self.padding, self.kernel_size)
+        weight, bias = self.scaled_parameters()
 
         return F.conv_transpose2d(
             x,
-            self.weight * self.weight_scale,
-            self.bias * self.weight_scale,
+            weight,
+            bias,
             self.stride,
             self.padding,
             output_padding,
             self.groups,
             self.dilation
         )
+
+
+def freeze_equalized_learning_rate(module):
+    """
+    Folds the equalized learning rate scale into the weights of every conv inside of module
+    :param module: module to freeze for inference
+    """
+    for m in module.modules():
+        if isinstance(m, _EqualizedLearningRate):
+            m.freeze()
+
+
+class NearestUpsampleConv2d(nn.Conv2d):
+    """
+    3x3 convolution applied to the input upsampled 2x with nearest neighbour interpolation, computed as one
+    transposed convolution whose 4x4 kernel is derived from the 3x3 weight on every forward.
+    The parameters are those of a plain nn.Conv2d, so checkpoints and spectral normalization work unchanged
+    """
+
+    def __init__(self, in_channels, out_channels, bias=True):
+        super().__init__(in_channels, out_channels, kernel_size=3, stride=1, padding=1, bias=bias)
+
+    def forward(self, x):
+        # Output 2i + a reads the upsampled rows 2i + a - 1 .. 2i + a + 1, which are the input rows
+        # i - 1, i, i for a = 0 and i, i, i + 1 for a = 1. The transposed conv places input row i
+        # at output rows 2i - 1 .. 2i + 2 with taps 0 .. 3, each tap sums the matching 3x3 taps
+        taps = self.weight.new_tensor([
+            [0, 0, 1],
+            [0, 1, 1],
+            [1, 1, 0],
+            [1, 0, 0]
+        ])
+
+        # [O x I x 3 x 3] => [I x O x 4 x 4]
+        weight = torch.einsum("tk,oikl,sl->iots", taps, self.weight, taps)
+
+        return F.conv_transpose2d(x, weight, self.bias, stride=2, padding=1)
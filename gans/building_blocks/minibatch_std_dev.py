@@ -8,35 +8,45 @@ class MinibatchStdDev(nn.Module):
     Minibatch standard deviation layer for the discriminator
     """
 
-    def __init__(self):
+    def __init__(self, group_size=None):
         """
         derived class constructor
+        :param group_size: number of samples sharing one statistic like in ProGAN, the whole sub-batch if None
         """
         super().__init__()
 
-    def forward(self, x, alpha=1e-8):
+        self.group_size = group_size
+
+    def forward(self, x, alpha=1e-8, chunks=1):
         """
         forward pass of the layer
         :param x: input activation volume
         :param alpha: small number for numerical stability
+        :param chunks: number of independent, equally sized sub-batches x consists of, e.g. for fused forwards
         :return: y => x appended with standard deviation constant map
         """
-        batch_size, _, height, width = x.shape
+        batch_size, channels, height, width = x.shape
+        sub_batch_size = batch_size // chunks
 
-        # [B x C x H x W] Subtract mean over batch.
-        y = x - x.mean(dim=0, keepdim=True)
+        group_size = sub_batch_size if self.group_size is None else min(self.group_size, sub_batch_size)
+        if sub_batch_size % group_size != 0:
+            raise ValueError("Batch size {} is not divisible by the group size {}".format(sub_batch_size, group_size))
 
-        # [1 x C x H x W]  Calc standard deviation over batch
-        y = torch.sqrt(y.pow(2.).mean(dim=0, keepdim=False) + alpha)
+        # [N x G x M x C x H x W] Split into the sub-batches, sample m + i * M belongs to group m
+        y = x.view(chunks, group_size, -1, channels, height, width)
 
-        # [1]  Take average over feature_maps and pixels.
-        y = y.mean().view(1, 1, 1, 1)
+        # [N x M x C x H x W]  Calc standard deviation over group
+        y = torch.var(y, dim=1, unbiased=False).add_(alpha).sqrt_()
 
-        # [B x 1 x H x W]  Replicate over group and pixels.
-        y = y.repeat(batch_size, 1, height, width)
+        # [N x M]  Take average over feature_maps and pixels.
+        y = y.view(chunks, sub_batch_size // group_size, -1).mean(dim=2)
 
-        # [B x C x H x W]  Append as new feature_map.
-        y = torch.cat([x, y], 1)
+        # [B x (C + 1) x H x W]  Append as new feature_map, the statistic is broadcast into the output without a copy of its own
+        output = x.new_empty(batch_size, channels + 1, height, width)
+        output[:, :channels].copy_(x)
+        output[:, channels:].view(chunks, group_size, -1, 1, height, width).copy_(
+            y.view(chunks, 1, -1, 1, 1, 1).expand(-1, group_size, -1, 1, height, width)
+        )
 
         # return the computed values:
-        return y
+        return output
@@ -7,10 +7,5 @@ class PixelNorm(nn.Module):
         super().__init__()
 
     def forward(self, x, alpha=1e-8):
-        y = x ** 2
-        y = y.mean(dim=1, keepdim=True)
-        y = y + alpha
-        y = y.sqrt()
-
-        y = x / y
-        return y
+        # x / sqrt(mean(x^2) + alpha), the normalizer is built in place and multiplied once
+        return x * x.pow(2).mean(dim=1, keepdim=True).add_(alpha).rsqrt_()
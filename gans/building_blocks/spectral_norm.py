@@ -0,0 +1,166 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+class SpectralNorm:
+    """
+    Spectral normalization like torch.nn.utils.spectral_norm with the same parameter and buffer names, so
+    checkpoints are interchangeable. The power iteration only runs after the weight changed, which an optimizer
+    step or loading a checkpoint does in place, instead of on every forward. Forwards that do not build a graph
+    reuse the normalized weight until the next change
+    """
+
+    def __init__(self, name="weight", n_power_iterations=1, dim=0, eps=1e-12):
+        self.name = name
+        self.n_power_iterations = n_power_iterations
+        self.dim = dim
+        self.eps = eps
+
+        self.iterated_key = None
+        self.cached_key = None
+        self.cached_weight = None
+
+    def reshape_weight_to_matrix(self, weight):
+        if self.dim != 0:
+            # Permute dim to front
+            weight = weight.permute(self.dim, *[d for d in range(weight.dim()) if d != self.dim])
+
+        return weight.reshape(weight.size(0), -1)
+
+    def compute_weight(self, module):
+        weight = getattr(module, self.name + "_orig")
+        u = getattr(module, self.name + "_u")
+        v = getattr(module, self.name + "_v")
+
+        # The tensor itself is part of the key, DataParallel replicas get fresh weights on every forward,
+        # often at the same address and with the same version, and share this hook across devices
+        key = (weight, weight._version, weight.data_ptr())
+        building_graph = torch.is_grad_enabled() and weight.requires_grad
+
+        if not building_graph and self.key_matches(self.cached_key, key):
+            return self.cached_weight
+
+        weight_mat = self.reshape_weight_to_matrix(weight)
+
+        if module.training and not self.key_matches(self.iterated_key, key):
+            with torch.no_grad():
+                for _ in range(self.n_power_iterations):
+                    # Spectral norm of weight equals to `u^T W v`, where `u` and `v` are the first left and right singular vectors
+                    v = F.normalize(torch.mv(weight_mat.t(), u), dim=0, eps=self.eps, out=v)
+                    u = F.normalize(torch.mv(weight_mat, v), dim=0, eps=self.eps, out=u)
+
+            self.iterated_key = key
+
+        if building_graph:
+            # The graph keeps its own copies, the next power iteration updates u and v in place
+            u = u.clone(memory_format=torch.contiguous_format)
+            v = v.clone(memory_format=torch.contiguous_format)
+
+        sigma = torch.dot(u, torch.mv(weight_mat, v))
+        weight = weight / sigma
+
+        if building_graph:
+            self.cached_key = None
+            self.cached_weight = None
+        else:
+            self.cached_key = key
+            self.cached_weight = weight
+
+        return weight
+
+    @staticmethod
+    def key_matches(cached_key, key):
+        return cached_key is not None and cached_key[0] is key[0] and cached_key[1:] == key[1:]
+
+    def __call__(self, module, inputs):
+        setattr(module, self.name, self.compute_weight(module))
+
+    def remove(self, module):
+        with torch.no_grad():
+            weight = self.compute_weight(module)
+
+        delattr(module, self.name)
+        delattr(module, self.name + "_u")
+        delattr(module, self.name + "_v")
+        delattr(module, self.name + "_orig")
+        module.register_parameter(self.name, nn.Parameter(weight.detach()))
+
+    def __getstate__(self):
+        # The cached weight belongs to the module it was computed for
+        state = self.__dict__.copy()
+        state["iterated_key"] = None
+        state["cached_key"] = None
+        state["cached_weight"] = None
+
+        return state
+
+    @staticmethod
+    def apply(module, name, n_power_iterations, dim, eps):
+        fn = SpectralNorm(name, n_power_iterations, dim, eps)
+        weight = module._parameters[name]
+
+        with torch.no_grad():
+            weight_mat = fn.reshape_weight_to_matrix(weight)
+            h, w = weight_mat.size()
+
+            # randomly initialize `u` and `v`
+            u = F.normalize(weight.new_empty(h).normal_(0, 1), dim=0, eps=fn.eps)
+            v = F.normalize(weight.new_empty(w).normal_(0, 1), dim=0, eps=fn.eps)
+
+        delattr(module, fn.name)
+        module.register_parameter(fn.name + "_orig", weight)
+        setattr(module, fn.name, weight.data)
+        module.register_buffer(fn.name + "_u", u)
+        module.register_buffer(fn.name + "_v", v)
+
+        module.register_forward_pre_hook(fn)
+        module._register_state_dict_hook(SpectralNormStateDictHook(fn))
+
+        return fn
+
+
+class SpectralNormStateDictHook:
+    # Same metadata as torch.nn.utils.spectral_norm, so its loading hook accepts these checkpoints
+    def __init__(self, fn):
+        self.fn = fn
+
+    def __call__(self, module, state_dict, prefix, local_metadata):
+        local_metadata.setdefault("spectral_norm", {})[self.fn.name + ".version"] = 1
+
+
+def spectral_norm(module, name="weight", n_power_iterations=1, eps=1e-12, dim=None):
+    """
+    Applies spectral normalization to a parameter of module
+    :param module: containing module
+    :param name: name of the weight parameter
+    :param n_power_iterations: number of power iterations per weight change
+    :param eps: epsilon for numerical stability when normalizing
+    :param dim: dimension corresponding to the number of outputs, 1 for transposed convolutions and 0 otherwise if None
+    :return: the module with the spectral norm hook
+    """
+    if dim is None:
+        if isinstance(module, (nn.ConvTranspose1d, nn.ConvTranspose2d, nn.ConvTranspose3d)):
+            dim = 1
+        else:
+            dim = 0
+
+    SpectralNorm.apply(module, name, n_power_iterations, dim, eps)
+
+    return module
+
+
+def freeze_spectral_norm(module):
+    """
+    Replaces every spectral normalized weight inside of module by a plain parameter holding the normalized weight
+    :param module: module to freeze for inference
+    """
+    for m in module.modules():
+        for key, hook in list(m._forward_pre_hooks.items()):
+            if isinstance(hook, SpectralNorm):
+                hook.remove(m)
+                del m._forward_pre_hooks[key]
+
+        for key, hook in list(m._state_dict_hooks.items()):
+            if isinstance(hook, SpectralNormStateDictHook):
+                del m._state_dict_hooks[key]
@@ -1,2 +1,5 @@
-from .celeba_hq import CelebAHQ
+from .celeba_hq import CelebAHQ, PackedCelebAHQ
 from .flat_image_folder import FlatImageFolder
+from .in_memory import InMemoryImageDataset, InMemoryDataLoader
+from .packed_image_folder import PackedImageFolder, pack_image_folder
+from .transforms import ToUint8Tensor
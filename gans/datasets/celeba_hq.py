@@ -1,9 +1,16 @@
 from torchvision.datasets.folder import default_loader
 
 from gans.datasets.flat_image_folder import FlatImageFolder
+from gans.datasets.packed_image_folder import PackedImageFolder
 
 
 class CelebAHQ(FlatImageFolder):
-    def __init__(self, root, image_size=1024, transform=None, loader=default_loader):
+    def __init__(self, root, image_size=1024, transform=None, loader=default_loader, validate=False):
         root += "/celebAHQ/data" + str(image_size) + "x" + str(image_size)
-        super().__init__(root, transform, loader)
+        super().__init__(root, transform, loader, validate=validate)
+
+
+class PackedCelebAHQ(PackedImageFolder):
+    def __init__(self, root, image_size=1024, cache_root=None, loader=default_loader):
+        root += "/celebAHQ/data" + str(image_size) + "x" + str(image_size)
+        super().__init__(root, image_size, cache_root, loader)
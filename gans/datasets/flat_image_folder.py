@@ -1,17 +1,112 @@
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 
+from PIL import Image
 from torch.utils.data import Dataset
 from torchvision.datasets.folder import default_loader
 from torchvision.datasets.folder import is_image_file
 
+MANIFEST_VERSION = 1
+
+
+def probe_image(path, validate=False):
+    """
+    Reads size, modification time and dimensions of an image file
+    :param path: path of the image
+    :param validate: fully decode the image instead of only reading its header
+    :return: manifest entry, width and height are None if the image can not be decoded
+    """
+    stat = os.stat(path)
+    entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "width": None, "height": None}
+
+    try:
+        with Image.open(path) as image:
+            if validate:
+                image.load()
+
+            entry["width"], entry["height"] = image.size
+    except (OSError, ValueError, SyntaxError):
+        pass
+
+    return entry
+
 
 class FlatImageFolder(Dataset):
-    def __init__(self, root, transform=None, loader=default_loader):
+    def __init__(self, root, transform=None, loader=default_loader, manifest=True, manifest_path=None, validate=False, num_workers=16):
+        """
+        :param root: folder containing the images
+        :param transform: transform applied to each loaded image
+        :param loader: function loading an image from a path
+        :param manifest: cache the file index in a manifest instead of listing the folder on every start
+        :param manifest_path: path of the manifest, defaults to a file next to the folder
+        :param validate: fully decode every new image once while indexing and drop the ones that fail
+        :param num_workers: number of threads probing new or changed files
+        """
         self.root = root + "/"
         self.transform = transform
         self.loader = loader
 
-        self.files = sorted([file for file in os.listdir(self.root) if is_image_file(file)])
+        if manifest:
+            if manifest_path is None:
+                # Kept outside of the folder, writing it would change the modification time of the folder
+                manifest_path = os.path.normpath(root) + ".manifest.json"
+
+            self.entries = self.index(manifest_path, validate, num_workers)
+            self.files = sorted([file for file, entry in self.entries.items() if entry["width"] is not None])
+        else:
+            self.entries = None
+            self.files = sorted([file for file in os.listdir(self.root) if is_image_file(file)])
+
+    def index(self, manifest_path, validate, num_workers):
+        directory_mtime_ns = os.stat(self.root).st_mtime_ns
+        cached = {}
+
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+
+            if manifest["version"] == MANIFEST_VERSION and (manifest["validated"] or not validate):
+                # Adding, removing or renaming files changes the modification time of the folder
+                if manifest["directory_mtime_ns"] == directory_mtime_ns:
+                    return manifest["files"]
+
+                cached = manifest["files"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+        def entry_fn(file):
+            stat = os.stat(self.root + file)
+            entry = cached.get(file)
+
+            # Only new or changed files get probed again
+            if entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                return entry
+
+            return probe_image(self.root + file, validate)
+
+        files = [file for file in os.listdir(self.root) if is_image_file(file)]
+
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            entries = dict(zip(files, executor.map(entry_fn, files)))
+
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "validated": validate,
+            "directory_mtime_ns": directory_mtime_ns,
+            "files": entries
+        }
+
+        try:
+            with open(manifest_path + ".tmp", "w") as f:
+                json.dump(manifest, f)
+
+            os.replace(manifest_path + ".tmp", manifest_path)
+        except OSError:
+            # Read-only dataset location, the index is rebuilt on the next start
+            pass
+
+        return entries
 
     def __getitem__(self, index: int):
         path = self.root + self.files[index]
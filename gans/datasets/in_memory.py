@@ -0,0 +1,103 @@
+import math
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+
+class InMemoryImageDataset:
+    """
+    Holds a whole dataset as one resized uint8 tensor of shape N x C x H x W
+    """
+
+    def __init__(self, images, targets):
+        self.images = images
+        self.targets = targets
+        self.scaled_images = None
+
+    @classmethod
+    def from_torchvision(cls, dataset, image_size, chunk_size=4096):
+        """
+        Builds the tensor from the raw data of a torchvision dataset like MNIST or CIFAR10, bypassing its transform
+        :param dataset: torchvision dataset exposing `data` and `targets`
+        :param image_size: height and width the images get resized to
+        :param chunk_size: number of images resized at once
+        :return: the in memory dataset
+        """
+        if not hasattr(dataset, "data") or not hasattr(dataset, "targets"):
+            raise ValueError("Dataset does not expose its raw data: " + type(dataset).__name__)
+
+        images = dataset.data if torch.is_tensor(dataset.data) else torch.from_numpy(np.asarray(dataset.data))
+
+        if images.dim() == 3:
+            # [N x H x W] => [N x 1 x H x W]
+            images = images.unsqueeze(1)
+        else:
+            # [N x H x W x C] => [N x C x H x W]
+            images = images.permute(0, 3, 1, 2)
+
+        images = images.contiguous()
+
+        if images.size(2) != image_size or images.size(3) != image_size:
+            images = torch.cat([
+                F.interpolate(chunk.float(), size=(image_size, image_size), mode="bilinear", align_corners=False).round_().clamp_(0, 255).to(torch.uint8)
+                for chunk in images.split(chunk_size)
+            ])
+
+        targets = torch.as_tensor(dataset.targets, dtype=torch.long)
+
+        return cls(images, targets)
+
+    def build_pyramid(self, sizes, chunk_size=4096):
+        """
+        Precomputes nearest neighbour downscaled copies of the images, batches then contain a list
+        of all sizes in ascending order followed by the images themselves
+        :param sizes: image sizes of the pyramid levels below the full resolution
+        :param chunk_size: number of images downscaled at once
+        """
+        self.scaled_images = [
+            torch.cat([
+                F.interpolate(chunk.float(), size=size).to(torch.uint8)
+                for chunk in self.images.split(chunk_size)
+            ])
+            for size in sizes
+        ]
+
+    def batch(self, indices):
+        if self.scaled_images is None:
+            return self.images[indices]
+
+        return [scaled_images[indices] for scaled_images in self.scaled_images] + [self.images[indices]]
+
+    def __len__(self):
+        return self.images.size(0)
+
+
+class InMemoryDataLoader:
+    """
+    Yields batches of an InMemoryImageDataset by slicing a permutation of its indices,
+    without dataloader workers and without per-sample Python code
+    """
+
+    def __init__(self, dataset, batch_size, shuffle=True, drop_last=True):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+
+    def __iter__(self):
+        if self.shuffle:
+            indices = torch.randperm(len(self.dataset))
+        else:
+            indices = torch.arange(len(self.dataset))
+
+        for start in range(0, len(self) * self.batch_size, self.batch_size):
+            batch_indices = indices[start:start + self.batch_size]
+
+            yield self.dataset.batch(batch_indices), self.dataset.targets[batch_indices]
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.dataset) // self.batch_size
+        else:
+            return math.ceil(len(self.dataset) / self.batch_size)
@@ -0,0 +1,125 @@
+import json
+import os
+
+import numpy as np
+import torch
+import torchvision.transforms as transforms
+from torch.utils.data import Dataset
+from torchvision.datasets.folder import default_loader
+
+from gans.datasets.flat_image_folder import FlatImageFolder
+
+
+def packed_paths(root, image_size, cache_root=None):
+    name = "packed" + str(image_size) + "x" + str(image_size)
+
+    if cache_root is None:
+        # Kept outside of the folder like its manifest, writing them would change the modification time of the folder
+        prefix = os.path.normpath(root) + "." + name
+    else:
+        prefix = os.path.join(cache_root, name)
+
+    return prefix + ".u8", prefix + ".json"
+
+
+def folder_signature(folder):
+    """
+    :param folder: indexed FlatImageFolder
+    :return: size and modification time of every image, a pack is valid as long as they do not change
+    """
+    return {file: [folder.entries[file]["size"], folder.entries[file]["mtime_ns"]] for file in folder.files}
+
+
+def pack_image_folder(root, image_size, cache_root=None, loader=default_loader):
+    """
+    Decodes and resizes every image of a flat image folder once and stores the result as a
+    memory-mapped uint8 array of shape N x C x H x W plus a JSON manifest describing it
+    :param root: folder containing the images
+    :param image_size: height and width the images get resized to
+    :param cache_root: folder the packed files get written to, defaults to files next to root
+    :param loader: function loading an image from a path
+    :return: paths of the packed data and of the manifest
+    """
+    data_path, manifest_path = packed_paths(root, image_size, cache_root)
+    folder = FlatImageFolder(root, transform=transforms.Resize((image_size, image_size)), loader=loader)
+
+    data = None
+    for index in range(len(folder)):
+        sample, _ = folder[index]
+        sample = np.asarray(sample, dtype=np.uint8)
+        sample = sample[:, :, None] if sample.ndim == 2 else sample
+
+        if data is None:
+            shape = (len(folder), sample.shape[2], image_size, image_size)
+            data = np.memmap(data_path + ".tmp", dtype=np.uint8, mode="w+", shape=shape)
+
+        # [H x W x C] => [C x H x W]
+        data[index] = sample.transpose(2, 0, 1)
+
+    if data is None:
+        raise ValueError("Can not pack an empty image folder: " + root)
+
+    data.flush()
+    del data
+
+    manifest = {
+        "files": folder.files,
+        "signature": folder_signature(folder),
+        "shape": list(shape),
+        "dtype": "uint8",
+        "image_size": image_size
+    }
+
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+
+    # Manifest is renamed last, its existence marks a complete pack
+    os.replace(data_path + ".tmp", data_path)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    return data_path, manifest_path
+
+
+class PackedImageFolder(Dataset):
+    """
+    Serves uint8 images of a flat image folder from a memory-mapped cache created by pack_image_folder.
+    Indexing with a list of indices returns a whole batch, which allows using it with a BatchSampler
+    """
+
+    def __init__(self, root, image_size, cache_root=None, loader=default_loader):
+        self.data_path, self.manifest_path = packed_paths(root, image_size, cache_root)
+
+        # Indexing uses the manifest of the folder, only new or changed files are looked at
+        signature = folder_signature(FlatImageFolder(root, loader=loader))
+        self.manifest = self.read_manifest()
+
+        if self.manifest is None or self.manifest.get("signature") != signature:
+            # Images were added, removed or changed since packing
+            pack_image_folder(root, image_size, cache_root, loader)
+            self.manifest = self.read_manifest()
+
+        self.shape = tuple(self.manifest["shape"])
+        self.files = self.manifest["files"]
+        self.data = None
+
+    def read_manifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def __getitem__(self, index):
+        if self.data is None:
+            # Mapped lazily, so every dataloader worker maps the file itself and all share the page cache
+            self.data = np.memmap(self.data_path, dtype=self.manifest["dtype"], mode="r", shape=self.shape)
+
+        if isinstance(index, int):
+            return torch.from_numpy(np.array(self.data[index])), 0
+
+        # [B x C x H x W] Fancy indexing copies the batch out of the mapping in one go
+        samples = torch.from_numpy(self.data[np.asarray(index)])
+        return samples, torch.zeros(len(index), dtype=torch.long)
+
+    def __len__(self):
+        return self.shape[0]
@@ -0,0 +1,22 @@
+import numpy as np
+import torch
+
+
+class ToUint8Tensor:
+    """
+    Converts a PIL image to a uint8 tensor of shape C x H x W without scaling it.
+    Normalization happens for the whole batch at once in GAN.training_step
+    """
+
+    def __call__(self, pic):
+        image = np.array(pic, dtype=np.uint8, copy=True)
+
+        if image.ndim == 2:
+            # [H x W] => [H x W x 1]
+            image = image[:, :, None]
+
+        # [H x W x C] => [C x H x W]
+        return torch.from_numpy(image).permute(2, 0, 1).contiguous()
+
+    def __repr__(self):
+        return self.__class__.__name__ + "()"
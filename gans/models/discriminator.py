@@ -2,8 +2,9 @@ import math
 
 import torch
 import torch.nn as nn
-from torch.nn.utils import spectral_norm
+import torch.nn.functional as F
 
+from gans.building_blocks.spectral_norm import spectral_norm
 from gans.architectures.HDCGAN import DownsampleHDCGANBlock, LastHDCGANBlock
 from gans.architectures.PROGAN import DownsampleProGANBlock, LastProGANBlock
 from gans.init import snn_weight_init, he_weight_init
@@ -70,8 +71,11 @@ class CatLinCombiner(nn.Module):
             self.activation = nn.SELU(inplace=True)
 
     def forward(self, x1, x2):
-        x = torch.cat([x1, x2], dim=1)
-        x = self.conv(x)
+        # Same as the conv over torch.cat([x1, x2]), each input is convolved with its slice of the weight
+        weight = self.conv.weight
+
+        x = F.conv2d(x1, weight[:, :x1.size(1)])
+        x = x.add_(F.conv2d(x2, weight[:, x1.size(1):], self.conv.bias))
         x = self.activation(x)
 
         return x
@@ -153,7 +157,8 @@ class Discriminator(nn.Module):
                     in_channels=self.filters[-2],
                     out_channels=self.filters[-1],
                     additional_channels=additional_channels,
-                    bias=self.bias
+                    bias=self.bias,
+                    group_size=self.hparams.minibatch_std_dev_group_size
                 )
             )
         elif self.hparams.architecture == "hdcgan":
@@ -162,7 +167,8 @@ class Discriminator(nn.Module):
                     in_channels=self.filters[-2],
                     out_channels=self.filters[-1],
                     additional_channels=additional_channels,
-                    bias=self.bias
+                    bias=self.bias,
+                    group_size=self.hparams.minibatch_std_dev_group_size
                 )
             )
 
@@ -178,9 +184,9 @@ class Discriminator(nn.Module):
 
     def block_fn(self, in_channels, out_channels, bias=False):
         if self.hparams.architecture == "progan":
-            return DownsampleProGANBlock(in_channels, out_channels, bias=bias)
+            return DownsampleProGANBlock(in_channels, out_channels, bias=bias, fused=self.hparams.fused_downsample)
         elif self.hparams.architecture == "hdcgan":
-            return DownsampleHDCGANBlock(in_channels, out_channels, bias=bias)
+            return DownsampleHDCGANBlock(in_channels, out_channels, bias=bias, fused=self.hparams.fused_downsample)
 
     def from_rgb_fn(self, in_channels, bias=False):
         if self.hparams.multi_scale_gradient_combiner == "simple":
@@ -192,35 +198,47 @@ class Discriminator(nn.Module):
         else:
             raise ValueError()
 
+    def block_forward(self, block, x, chunks):
+        # Only the last block holds the minibatch standard deviation
+        if block is self.blocks[-1]:
+            return block(x, chunks=chunks)
+
+        return block(x)
+
     # Dropout is just used for WGAN-CT
-    def forward(self, x, y, dropout=0.0, intermediate_output=False):
+    # Chunks is the number of equally sized batches concatenated in x, each gets its own minibatch statistics
+    def forward(self, x, y, dropout=0.0, intermediate_output=False, chunks=1):
         if isinstance(x, list):
             # msg enabled
             last_x_forward = None
             x = list(reversed(x))
 
-            x_forward = self.blocks[0](x[0])
+            x_forward = self.block_forward(self.blocks[0], x[0], chunks)
 
             for data, block, from_rgb in zip(x[1:], self.blocks[1:], self.from_rgb_combiners):
                 last_x_forward = x_forward
 
                 x_forward = from_rgb(data, x_forward)
                 x_forward = torch.dropout(x_forward, p=dropout, train=True)
-                x_forward = block(x_forward)
+                x_forward = self.block_forward(block, x_forward, chunks)
 
             if intermediate_output:
-                return x_forward, last_x_forward.mean()
+                return x_forward, last_x_forward.reshape(chunks, -1).mean(dim=1)
             else:
                 return x_forward
         else:
             last_x_forward = None
             x_forward = x
 
-            for block in self.blocks:
-                last_x_forward = x
-                x_forward = block(x_forward)
+            for pos, block in enumerate(self.blocks):
+                last_x_forward = x_forward
+
+                if pos > 0 and dropout > 0.0:
+                    x_forward = torch.dropout(x_forward, p=dropout, train=True)
+
+                x_forward = self.block_forward(block, x_forward, chunks)
 
             if intermediate_output:
-                return x_forward, last_x_forward.mean()
+                return x_forward, last_x_forward.reshape(chunks, -1).mean(dim=1)
             else:
                 return x_forward
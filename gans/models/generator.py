@@ -2,8 +2,8 @@ import math
 
 import torch
 import torch.nn as nn
-from torch.nn.utils import spectral_norm
 
+from gans.building_blocks.spectral_norm import spectral_norm
 from gans.architectures.HDCGAN import FirstHDCGANBlock, UpsampleHDCGANBlock
 from gans.architectures.PROGAN import FirstProGANBlock, UpsampleProGANBlock
 from gans.init import snn_weight_init, he_weight_init
@@ -16,13 +16,14 @@ class ZSkipConnector(nn.Module):
         self.conv = nn.Conv2d(in_channels, out_channels, 1, 1, 0, bias=bias)
 
     def forward(self, x, z):
-        height_multiplier = x.size(2) // z.size(2)
-        width_multiplier = x.size(3) // z.size(3)
+        batch_size, channels, height, width = x.shape
+        z_height, z_width = z.size(2), z.size(3)
 
-        z_repeated = z.repeat(1, 1, height_multiplier, width_multiplier)
-        z_repeated = self.conv(z_repeated)
+        # A 1x1 conv of the tiled z equals the tiled conv of z, the tiling is a broadcast over a blocked view of x
+        z = self.conv(z)
+        x = x.view(batch_size, channels, height // z_height, z_height, width // z_width, z_width) + z.view(batch_size, channels, 1, z_height, 1, z_width)
 
-        return x
+        return x.view(batch_size, channels, height, width)
 
 
 class Generator(nn.Module):
@@ -32,6 +33,13 @@ class Generator(nn.Module):
         self.hparams = hparams
         self.bias = True
 
+        if self.hparams.fused_upsample and self.hparams.architecture != "hdcgan":
+            # Bilinear upsampling followed by a zero padded conv has no exact single conv form at the borders
+            raise ValueError("Fused upsampling is only available for the hdcgan architecture")
+
+        if self.hparams.z_skip_connections and self.hparams.noise_size % 64 != 0:
+            raise ValueError("Z skip connections need a noise size divisible by 64")
+
         self.blocks = nn.ModuleList()
         self.to_rgb_converts = nn.ModuleList()
         self.z_skip_connections = nn.ModuleList()
@@ -118,7 +126,7 @@ class Generator(nn.Module):
         if self.hparams.architecture == "progan":
             return UpsampleProGANBlock(in_channels, out_channels, bias=bias)
         elif self.hparams.architecture == "hdcgan":
-            return UpsampleHDCGANBlock(in_channels, out_channels, bias=bias)
+            return UpsampleHDCGANBlock(in_channels, out_channels, bias=bias, fused=self.hparams.fused_upsample)
 
     def to_rgb_fn(self, in_channels, bias=False):
         return nn.Sequential(
@@ -135,17 +143,30 @@ class Generator(nn.Module):
     def z_skip_connection_fn(self, in_channels, out_channels, bias=False):
         return ZSkipConnector(in_channels, out_channels, bias)
 
-    def forward(self, x, y):
+    def forward(self, x, y, output_sizes=None, max_size=None):
+        """
+        :param x: noise
+        :param y: labels
+        :param output_sizes: resolutions to return images for, all resolutions if None
+        :param max_size: resolution after which the remaining blocks are skipped
+        :return: images in ascending resolution
+        """
         outputs = []
+        z = x.view(x.size(0), -1, 8, 8) if self.hparams.z_skip_connections else None
         x = x.view(x.size(0), -1, 1, 1)
-        # z = x.view(x.size(0), -1, 8, 8)
 
-        for block, to_rgb, z_skip in zip(self.blocks, self.to_rgb_converts, self.z_skip_connections):
+        for i, (block, to_rgb, z_skip) in enumerate(zip(self.blocks, self.to_rgb_converts, self.z_skip_connections)):
             x = block(x)
 
-            # if i > 0: x = z_skip(x, z)
+            if self.hparams.z_skip_connections and i > 0:
+                x = z_skip(x, z)
+
+            # Heads of resolutions nobody asked for are skipped
+            if output_sizes is None or x.size(2) in output_sizes:
+                output = torch.tanh(to_rgb(x))
+                outputs.append(output)
 
-            output = torch.tanh(to_rgb(x))
-            outputs.append(output)
+            if max_size is not None and x.size(2) >= max_size:
+                break
 
         return outputs
@@ -4,8 +4,99 @@
 import math
 
 import torch
+import torch.nn.functional as F
 from torch.optim.optimizer import Optimizer
 
+QUANTIZATION_BLOCK_SIZE = 256
+LOG_QUANTIZATION_LEVELS = 254
+ROUNDING_SEED = 0
+
+
+def uniform_noise(tensor, generator):
+    return torch.rand(tensor.shape, generator=generator, device=tensor.device)
+
+
+def round_bf16(tensor, generator):
+    """
+    Stochastic rounding to bf16. It keeps 8 significant bits, uniform noise of one unit in the last place
+    followed by rounding to nearest rounds up with a probability equal to the distance from the value below
+    :param tensor: fp32 tensor
+    :param generator: generator of the rounding noise
+    :return: rounded fp32 tensor, its conversion to bf16 is exact
+    """
+    ulp = torch.pow(2.0, torch.floor(torch.log2(tensor.abs())).sub_(7))
+
+    return tensor.add(uniform_noise(tensor, generator).sub_(0.5).mul_(ulp))
+
+
+def to_blocks(tensor):
+    values = tensor.reshape(-1)
+    values = F.pad(values, [0, -values.numel() % QUANTIZATION_BLOCK_SIZE])
+
+    return values.view(-1, QUANTIZATION_BLOCK_SIZE)
+
+
+def from_blocks(values, shape):
+    return values.view(-1)[:shape.numel()].view(shape)
+
+
+def quantize_blockwise(tensor, generator):
+    """
+    Linear int8 quantization with one absolute maximum per block of values and stochastic rounding
+    :param tensor: tensor to quantize
+    :param generator: generator of the rounding noise
+    :return: codes and absolute maximum of each block
+    """
+    blocks = to_blocks(tensor)
+
+    absmax = blocks.abs().max(dim=1, keepdim=True)[0]
+    scaled = (blocks / absmax.clamp(min=1e-30)).mul_(127)
+
+    # Rounding to nearest would keep values smaller than a few levels from decaying, stochastic rounding is unbiased
+    codes = scaled.add_(uniform_noise(scaled, generator)).floor_().to(torch.int8)
+
+    return codes, absmax.view(-1)
+
+
+def dequantize_blockwise(codes, absmax, shape):
+    return from_blocks(codes.float().mul_(absmax.view(-1, 1) / 127), shape)
+
+
+def quantize_blockwise_log(tensor, generator):
+    """
+    Logarithmic uint8 quantization of non-negative values with stochastic rounding. Code 0 is zero, the other
+    codes are spread evenly between the logarithms of the smallest and largest positive value of each block,
+    so every value keeps a bounded relative error instead of collapsing to zero next to a large one
+    :param tensor: non-negative tensor to quantize
+    :param generator: generator of the rounding noise
+    :return: codes and logarithms of the smallest and largest positive value of each block
+    """
+    blocks = to_blocks(tensor)
+    positive = blocks > 0
+
+    logs = blocks.clamp(min=1e-38).log_()
+    log_min = logs.masked_fill(~positive, math.inf).min(dim=1, keepdim=True)[0]
+    log_max = logs.masked_fill(~positive, -math.inf).max(dim=1, keepdim=True)[0]
+
+    # Blocks without positive values only hold code 0
+    empty = log_max < log_min
+    log_min = log_min.masked_fill_(empty, 0)
+    log_max = log_max.masked_fill_(empty, 0)
+
+    scaled = (logs - log_min).div_((log_max - log_min).clamp_(min=1e-12)).mul_(LOG_QUANTIZATION_LEVELS)
+    codes = scaled.add_(uniform_noise(scaled, generator)).floor_().clamp_(0, LOG_QUANTIZATION_LEVELS).add_(1)
+    codes = codes.masked_fill_(~positive, 0).to(torch.uint8)
+
+    return codes, torch.cat([log_min, log_max], dim=1)
+
+
+def dequantize_blockwise_log(codes, log_range, shape):
+    log_min, log_max = log_range[:, :1], log_range[:, 1:]
+
+    values = (codes.float() - 1).mul_((log_max - log_min) / LOG_QUANTIZATION_LEVELS).add_(log_min).exp_()
+
+    return from_blocks(values.masked_fill_(codes == 0, 0), shape)
+
 
 class OAdam(Optimizer):
     r"""Implements optimistic Adam algorithm.
@@ -24,13 +115,23 @@ class OAdam(Optimizer):
         amsgrad (boolean, optional): whether to use the AMSGrad variant of this
             algorithm from the paper `On the Convergence of Adam and Beyond`_
             (default: False)
+        state_dtype (str, optional): storage of the moment estimates, None for
+            fp32, 'bf16' or 'int8' for blockwise quantized 8-bit, linear for the
+            first and logarithmic for the second moments. They are decoded to fp32
+            for each update and encoded with stochastic rounding, with beta2 close
+            to 1 the per step decay of the second moments is below the rounding
+            error of both formats and rounding to nearest would keep them from
+            ever decreasing (default: None)
+        foreach (bool, optional): update all parameters of a group with multi
+            tensor operations, None to use them when torch provides them
+            (default: None)
 
     .. _Training GANs with Optimism:
         https://arxiv.org/abs/1711.00141
     """
 
     def __init__(self, params, lr=1e-3, betas=(0.9, 0.999), eps=1e-8,
-                 weight_decay=0, amsgrad=False):
+                 weight_decay=0, amsgrad=False, state_dtype=None, foreach=None):
         if not 0.0 <= lr:
             raise ValueError("Invalid learning rate: {}".format(lr))
         if not 0.0 <= eps:
@@ -39,15 +140,60 @@ class OAdam(Optimizer):
             raise ValueError("Invalid beta parameter at index 0: {}".format(betas[0]))
         if not 0.0 <= betas[1] < 1.0:
             raise ValueError("Invalid beta parameter at index 1: {}".format(betas[1]))
+        if foreach and not hasattr(torch, '_foreach_addcdiv_'):
+            raise ValueError("Multi tensor operations are not available in torch {}".format(torch.__version__))
+        if state_dtype not in [None, 'bf16', 'int8']:
+            raise ValueError("Invalid state dtype: {}".format(state_dtype))
         defaults = dict(lr=lr, betas=betas, eps=eps,
-                        weight_decay=weight_decay, amsgrad=amsgrad)
+                        weight_decay=weight_decay, amsgrad=amsgrad, state_dtype=state_dtype, foreach=foreach)
         super(OAdam, self).__init__(params, defaults)
 
+        # Rounding noise has its own generators, compact states do not change the global random number stream
+        self._generators = {}
+
     def __setstate__(self, state):
         super(OAdam, self).__setstate__(state)
         for group in self.param_groups:
             group.setdefault('amsgrad', False)
+            group.setdefault('state_dtype', None)
+            group.setdefault('foreach', None)
+        self._generators = {}
+
+    def load_state_dict(self, state_dict):
+        super(OAdam, self).load_state_dict(state_dict)
+
+        # Loading casts all tensor states to the parameter dtype, compact states are restored to their storage dtypes
+        for group in self.param_groups:
+            if group['state_dtype'] is None:
+                continue
 
+            for p in group['params']:
+                state = self.state[p]
+
+                for key, dtype in zip(self._moments(group), self._storage_dtypes(group)):
+                    if key in state:
+                        state[key] = state[key].to(dtype)
+
+    def _generator(self, device):
+        if device not in self._generators:
+            self._generators[device] = torch.Generator(device=device)
+            self._generators[device].manual_seed(ROUNDING_SEED)
+
+        return self._generators[device]
+
+    @staticmethod
+    def _moments(group):
+        return ['exp_avg', 'exp_avg_sq', 'max_exp_avg_sq'] if group['amsgrad'] else ['exp_avg', 'exp_avg_sq']
+
+    @staticmethod
+    def _storage_dtypes(group):
+        if group['state_dtype'] == 'bf16':
+            return [torch.bfloat16] * 3
+
+        # Codes of the first moment are signed, the ones of the second moments logarithmic and unsigned
+        return [torch.int8, torch.uint8, torch.uint8]
+
+    @torch.no_grad()
     def step(self, closure=None):
         """Performs a single optimization step.
 
@@ -57,59 +203,169 @@ class OAdam(Optimizer):
         """
         loss = None
         if closure is not None:
-            loss = closure()
+            with torch.enable_grad():
+                loss = closure()
 
         for group in self.param_groups:
+            # Parameters are bucketed by step count, each bucket is updated with the same step size
+            buckets = {}
+
             for p in group['params']:
                 if p.grad is None:
                     continue
-                grad = p.grad.data
-                if grad.is_sparse:
+                if p.grad.is_sparse:
                     raise RuntimeError('Adam does not support sparse gradients, please consider SparseAdam instead')
-                amsgrad = group['amsgrad']
 
                 state = self.state[p]
 
+                if group['state_dtype'] is not None:
+                    self._compact_step(group, p, state)
+                    continue
+
                 # State initialization
                 if len(state) == 0:
                     state['step'] = 0
                     # Exponential moving average of gradient values
-                    state['exp_avg'] = torch.zeros_like(p.data)
+                    state['exp_avg'] = torch.zeros_like(p, memory_format=torch.preserve_format)
                     # Exponential moving average of squared gradient values
-                    state['exp_avg_sq'] = torch.zeros_like(p.data)
-                    if amsgrad:
+                    state['exp_avg_sq'] = torch.zeros_like(p, memory_format=torch.preserve_format)
+                    if group['amsgrad']:
                         # Maintains max of all exp. moving avg. of sq. grad. values
-                        state['max_exp_avg_sq'] = torch.zeros_like(p.data)
-
-                exp_avg, exp_avg_sq = state['exp_avg'], state['exp_avg_sq']
-                if amsgrad:
-                    max_exp_avg_sq = state['max_exp_avg_sq']
-                beta1, beta2 = group['betas']
+                        state['max_exp_avg_sq'] = torch.zeros_like(p, memory_format=torch.preserve_format)
 
                 state['step'] += 1
 
-                if group['weight_decay'] != 0:
-                    grad.add_(group['weight_decay'], p.data)
+                bucket = buckets.setdefault(state['step'], ([], [], [], [], []))
+                bucket[0].append(p)
+                bucket[1].append(p.grad)
+                bucket[2].append(state['exp_avg'])
+                bucket[3].append(state['exp_avg_sq'])
+                if group['amsgrad']:
+                    bucket[4].append(state['max_exp_avg_sq'])
+
+            for step, (params, grads, exp_avgs, exp_avg_sqs, max_exp_avg_sqs) in buckets.items():
+                foreach = hasattr(torch, '_foreach_addcdiv_') if group['foreach'] is None else group['foreach']
+
+                if foreach:
+                    self._multi_tensor_step(group, step, params, grads, exp_avgs, exp_avg_sqs, max_exp_avg_sqs)
+                else:
+                    for i, p in enumerate(params):
+                        max_exp_avg_sq = max_exp_avg_sqs[i] if group['amsgrad'] else None
+                        self._single_tensor_step(group, step, p, grads[i], exp_avgs[i], exp_avg_sqs[i], max_exp_avg_sq)
+
+        return loss
+
+    def _compact_step(self, group, p, state):
+        moments = self._moments(group)
+        generator = self._generator(p.device)
 
-                bias_correction1 = 1 - beta1 ** state['step']
-                bias_correction2 = 1 - beta2 ** state['step']
-                step_size = group['lr'] * math.sqrt(bias_correction2) / bias_correction1
+        # State initialization
+        if len(state) == 0:
+            state['step'] = 0
+            for key in moments:
+                self._encode(group, state, key, torch.zeros_like(p, memory_format=torch.preserve_format), generator)
 
-                # Optimistic update :)
-                p.data.addcdiv_(exp_avg, exp_avg_sq.sqrt().add(group['eps']), value=step_size)
+        state['step'] += 1
 
-                # Decay the first and second moment running average coefficient
-                exp_avg.mul_(beta1).add_(grad, alpha=1 - beta1)
-                exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
-                if amsgrad:
-                    # Maintains the maximum of all 2nd moment running avg. till now
-                    # noinspection PyUnboundLocalVariable
+        # Moments are decoded to fp32 one parameter at a time, updated and encoded again
+        values = [self._decode(group, state, key, p) for key in moments]
+        max_exp_avg_sq = values[2] if group['amsgrad'] else None
+        self._single_tensor_step(group, state['step'], p, p.grad, values[0], values[1], max_exp_avg_sq)
+
+        for key, value in zip(moments, values):
+            self._encode(group, state, key, value, generator)
+
+    @staticmethod
+    def _encode(group, state, key, value, generator):
+        if group['state_dtype'] == 'bf16':
+            value = round_bf16(value, generator)
+
+            if key in state and state[key].dtype == torch.bfloat16:
+                state[key].copy_(value)
+            else:
+                state[key] = value.to(torch.bfloat16)
+        elif group['state_dtype'] == 'int8':
+            if key == 'exp_avg':
+                state[key], state[key + '_absmax'] = quantize_blockwise(value, generator)
+            else:
+                state[key], state[key + '_log_range'] = quantize_blockwise_log(value, generator)
+
+    @staticmethod
+    def _decode(group, state, key, p):
+        if group['state_dtype'] == 'bf16':
+            return state[key].float()
+        elif group['state_dtype'] == 'int8':
+            if key == 'exp_avg':
+                return dequantize_blockwise(state[key], state[key + '_absmax'], p.shape)
+            else:
+                return dequantize_blockwise_log(state[key], state[key + '_log_range'], p.shape)
+
+    @staticmethod
+    def _step_size(group, step):
+        beta1, beta2 = group['betas']
+
+        bias_correction1 = 1 - beta1 ** step
+        bias_correction2 = 1 - beta2 ** step
+
+        return group['lr'] * math.sqrt(bias_correction2) / bias_correction1
+
+    def _single_tensor_step(self, group, step, p, grad, exp_avg, exp_avg_sq, max_exp_avg_sq):
+        beta1, beta2 = group['betas']
+        step_size = self._step_size(group, step)
+
+        if group['weight_decay'] != 0:
+            grad = grad.add(p, alpha=group['weight_decay'])
+
+        # Optimistic update :)
+        denom = exp_avg_sq.sqrt().add_(group['eps'])
+        p.addcdiv_(exp_avg, denom, value=step_size)
+
+        # Decay the first and second moment running average coefficient
+        exp_avg.mul_(beta1).add_(grad, alpha=1 - beta1)
+        exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+        if group['amsgrad']:
+            # Maintains the maximum of all 2nd moment running avg. till now
+            torch.max(max_exp_avg_sq, exp_avg_sq, out=max_exp_avg_sq)
+            # Use the max. for normalizing running avg. of gradient, the denominator buffer is reused
+            torch.sqrt(max_exp_avg_sq, out=denom)
+        else:
+            torch.sqrt(exp_avg_sq, out=denom)
+
+        p.addcdiv_(exp_avg, denom.add_(group['eps']), value=-2.0 * step_size)
+
+    def _multi_tensor_step(self, group, step, params, grads, exp_avgs, exp_avg_sqs, max_exp_avg_sqs):
+        # Same update as _single_tensor_step, each operation runs on all tensors at once
+        beta1, beta2 = group['betas']
+        step_size = self._step_size(group, step)
+
+        if group['weight_decay'] != 0:
+            grads = torch._foreach_add(grads, params, alpha=group['weight_decay'])
+
+        # Optimistic update :)
+        denoms = torch._foreach_sqrt(exp_avg_sqs)
+        torch._foreach_add_(denoms, group['eps'])
+        torch._foreach_addcdiv_(params, exp_avgs, denoms, value=step_size)
+
+        # Decay the first and second moment running average coefficient
+        torch._foreach_mul_(exp_avgs, beta1)
+        torch._foreach_add_(exp_avgs, grads, alpha=1 - beta1)
+        torch._foreach_mul_(exp_avg_sqs, beta2)
+        torch._foreach_addcmul_(exp_avg_sqs, grads, grads, value=1 - beta2)
+        if group['amsgrad']:
+            # Maintains the maximum of all 2nd moment running avg. till now
+            if hasattr(torch, '_foreach_maximum_'):
+                torch._foreach_maximum_(max_exp_avg_sqs, exp_avg_sqs)
+            else:
+                for max_exp_avg_sq, exp_avg_sq in zip(max_exp_avg_sqs, exp_avg_sqs):
                     torch.max(max_exp_avg_sq, exp_avg_sq, out=max_exp_avg_sq)
-                    # Use the max. for normalizing running avg. of gradient
-                    denom = max_exp_avg_sq.sqrt().add_(group['eps'])
-                else:
-                    denom = exp_avg_sq.sqrt().add_(group['eps'])
 
-                p.data.addcdiv_(exp_avg, denom, value=-2.0 * step_size)
+            sources = max_exp_avg_sqs
+        else:
+            sources = exp_avg_sqs
 
-        return loss
+        # The denominator buffers are reused, like torch.sqrt(..., out=denom) in _single_tensor_step
+        torch._foreach_mul_(denoms, 0.0)
+        torch._foreach_add_(denoms, sources)
+        torch._foreach_sqrt_(denoms)
+        torch._foreach_add_(denoms, group['eps'])
+        torch._foreach_addcdiv_(params, exp_avgs, denoms, value=-2.0 * step_size)